@@ -23,11 +23,9 @@ import requests
 from bs4 import BeautifulSoup
 import contractions
 
-nltk.download('punkt')
-nltk.download('stopwords')
-nltk.download('averaged_perceptron_tagger')
-nltk.download('wordnet')
-nltk.download('omw-1.4')
+from src.features import nltk_data
+# the NLTK data is provisioned once with: python src/features/nltk_data.py
+nltk_data.require(*nltk_data.RESOURCES)
 
 
 from gensim import corpora, models
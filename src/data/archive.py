@@ -0,0 +1,254 @@
+# archive of the raw reddit API responses, and tables rebuilt from it
+import gzip
+import json
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Tuple
+
+from metrics import current_request
+from schema import subreddit_row, post_row, comment_row
+
+
+class PayloadArchive:
+    """
+    Append-only archive of the JSON returned by the reddit API.
+
+    Every response is written as one line of a gzip compressed JSON lines
+    segment, one segment per subreddit and run:
+    {archive_dir}/{subreddit}/{order}_{run start}.jsonl.gz. Each line holds
+    the request type, method, path, params and the parsed response.
+
+    Usage:
+        archive = PayloadArchive(path, 'hot')
+        session.request = archive.wrap(session.request)
+        ...
+        archive.close()
+    """
+
+    def __init__(self, path, order_tag: str, compresslevel: int = 6):
+        """
+        PayloadArchive constructor
+
+        :param path: the archive folder
+        :param order_tag: scrape order(s) of the run, see
+                          ScraperConfig.order_tag
+        :param compresslevel: gzip compression level
+        """
+        self.path = Path(path)
+        self.order_tag = order_tag
+        self.compresslevel = compresslevel
+        self._run = time.strftime('%Y%m%dT%H%M%S')
+        self._segments = {}
+
+    def segment_path(self, subreddit_name: str) -> Path:
+        return self.path.joinpath(subreddit_name,
+                                  f'{self.order_tag}_{self._run}.jsonl.gz')
+
+    def write(self, subreddit_name: str, request_type: str, method: str,
+              path: str, params, payload):
+        segment = self._segments.get(subreddit_name)
+        if segment is None:
+            segment_path = self.segment_path(subreddit_name)
+            segment_path.parent.mkdir(parents=True, exist_ok=True)
+            # a resumed run appends another gzip member to the segment,
+            # which gzip reads as one stream
+            segment = gzip.open(segment_path, 'at',
+                                compresslevel=self.compresslevel)
+            self._segments[subreddit_name] = segment
+        segment.write(json.dumps({
+            'time': time.time(),
+            'type': request_type,
+            'method': method,
+            'path': path,
+            'params': (params if isinstance(params, (dict, type(None)))
+                       else str(params)),
+            'payload': payload
+        }) + '\n')
+
+    def wrap(self, request):
+        """
+        :param request: the request method of a reddit session, which returns
+                        the parsed JSON
+        :return: the request method that also archives the responses of
+                 measured scraper requests
+        """
+        async def archived_request(method, path, params=None, **kwargs):
+            payload = await request(method, path, params=params, **kwargs)
+            current = current_request()
+            if current is not None:
+                self.write(*current, method, path, params, payload)
+            return payload
+        return archived_request
+
+    def close(self):
+        for segment in self._segments.values():
+            segment.close()
+        self._segments = {}
+
+
+def read_segments(path, subreddit_name: str,
+                  order_tag: str) -> Iterator[dict]:
+    """
+    :return: the archived responses of the subreddit and scrape order(s),
+             oldest first
+    """
+    segment_paths = Path(path).joinpath(subreddit_name).glob(
+        f'{order_tag}_*.jsonl.gz')
+    for segment_path in sorted(segment_paths):
+        with gzip.open(segment_path, 'rt') as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def _flatten_comments(children: List[dict]) -> List[dict]:
+    """
+    Flattens a comment tree breadth-first, like asyncpraw's
+    CommentForest.list(), without the "more comments" stubs.
+    """
+    comments = []
+    queue = deque(children)
+    while queue:
+        child = queue.popleft()
+        if child['kind'] != 't1':
+            continue
+        comments.append(child['data'])
+        replies = child['data'].get('replies')
+        if replies:
+            queue.extend(replies['data']['children'])
+    return comments
+
+
+def _post(data: dict) -> SimpleNamespace:
+    return SimpleNamespace(**data)
+
+
+def _comment(data: dict) -> SimpleNamespace:
+    return SimpleNamespace(submission=SimpleNamespace(id=data['link_id'][3:]),
+                           **data)
+
+
+class _ArchiveTables:
+    """
+    Posts and comments rebuilt from the archived responses, with one handler
+    per payload kind.
+    """
+
+    def __init__(self, max_comment_per_post: int):
+        self.max_comment_per_post = max_comment_per_post
+        self.subreddit = None
+        self.posts: Dict[str, dict] = {}
+        self.listings: Dict[str, List[str]] = defaultdict(list)
+        self.comments: Dict[str, Dict[str, dict]] = defaultdict(dict)
+        self.fetches: Dict[str, List[dict]] = {}
+
+    def finish_fetch(self, post_id: str):
+        post_comments = self.comments[post_id]
+        fetched = [data for data in self.fetches.pop(post_id, [])
+                   if not data.get('stickied')]
+        new = [data for data in fetched
+               if data['id'] not in post_comments][:self.max_comment_per_post]
+        for data in fetched:
+            if data['id'] in post_comments:
+                post_comments[data['id']] = data
+        for data in new:
+            post_comments[data['id']] = data
+
+    def subreddit_about(self, record: dict):
+        self.subreddit = record['payload']['data']
+
+    def listing(self, record: dict):
+        order = record['path'].rstrip('/').rsplit('/', 1)[-1]
+        for child in record['payload']['data']['children']:
+            if child['kind'] == 't3':
+                is_listing = record['type'] == 'listing'
+                self.post(child['data'], order if is_listing else None)
+            elif child['kind'] == 't1':
+                self.refresh_comment(child['data'])
+
+    def post(self, data: dict, order: str = None):
+        self.posts[data['id']] = data
+        if order is not None and order not in self.listings[data['id']]:
+            self.listings[data['id']].append(order)
+
+    def refresh_comment(self, data: dict):
+        post_comments = self.comments.get(data['link_id'][3:], {})
+        if data['id'] in post_comments:
+            post_comments[data['id']] = data
+
+    def thread(self, record: dict):
+        # a post with its comment tree, from a comment fetch or a
+        # "continue this thread" stub
+        payload = record['payload']
+        post = payload[0]['data']['children'][0]['data']
+        tree = _flatten_comments(payload[1]['data']['children'])
+        if record['type'] == 'comments':
+            self.finish_fetch(post['id'])
+            self.posts[post['id']] = post
+            self.fetches[post['id']] = tree
+        else:
+            self.fetches.setdefault(post['id'], []).extend(tree)
+
+    def more_comments(self, record: dict):
+        # expanded "more comments" stub
+        for thing in record['payload']['json']['data']['things']:
+            if thing['kind'] == 't1':
+                post_id = thing['data']['link_id'][3:]
+                self.fetches.setdefault(post_id, []).append(thing['data'])
+
+    def rows(self, subreddit_name: str):
+        for post_id in list(self.fetches):
+            self.finish_fetch(post_id)
+        subreddit_rows = [] if self.subreddit is None else [
+            subreddit_row(SimpleNamespace(**self.subreddit), subreddit_name)]
+        post_rows = [post_row(_post(self.posts[post_id]), subreddit_name,
+                              self.listings[post_id])
+                     for post_id in self.comments if post_id in self.posts]
+        comment_rows = [comment_row(_comment(data), subreddit_name)
+                        for post_comments in self.comments.values()
+                        for data in post_comments.values()
+                        if not data.get('stickied')]
+        return subreddit_rows, post_rows, comment_rows
+
+
+_HANDLERS = {
+    't5': _ArchiveTables.subreddit_about,
+    'Listing': _ArchiveTables.listing,
+    'thread': _ArchiveTables.thread,
+    'more': _ArchiveTables.more_comments,
+}
+
+
+def _payload_kind(payload) -> str:
+    if isinstance(payload, list):
+        return 'thread'
+    if 'json' in payload:
+        return 'more'
+    return payload.get('kind')
+
+
+def rebuild_rows(records: Iterator[dict], subreddit_name: str,
+                 max_comment_per_post: int
+                 ) -> Tuple[List[list], List[list], List[list]]:
+    """
+    Regenerates the subreddit, posts and comments rows the scraper wrote from
+    its archived responses.
+
+    Notes:
+        Like the scraper, a post is only written if its comments were fetched,
+        stickied posts and comments are skipped and every comment fetch
+        contributes at most max_comment_per_post comments that earlier fetches
+        did not return. Posts and comments fetched by several runs are written
+        once, with the values of the latest response (including refreshes
+        through the info endpoint).
+
+    :param records: archived responses, oldest first, see read_segments()
+    :return: subreddit rows, post rows and comment rows
+    """
+    tables = _ArchiveTables(max_comment_per_post)
+    for record in records:
+        handler = _HANDLERS.get(_payload_kind(record['payload']))
+        if handler is not None:
+            handler(tables, record)
+    return tables.rows(subreddit_name)
@@ -0,0 +1,252 @@
+# scraper throughput benchmark against the local reddit API stand-in
+import sys
+import argparse
+import asyncio
+import dataclasses
+import json
+import logging
+import multiprocessing
+import resource
+import socket
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+import pandas as pd
+
+from config import ScraperConfig
+from fake_reddit import FakeReddit
+from scraper import AsyncRedditScraper, logger
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _serve(port: int, server_kwargs: dict):
+    FakeReddit(**server_kwargs).run(port=port)
+
+
+def _wait_for_server(url: str, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(f'{url}/_stats'):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def run_benchmark(config: ScraperConfig, server_kwargs: dict = None) -> dict:
+    """
+    Runs the scraper against a FakeReddit server started in a separate
+    process.
+
+    :param config: the scraper config to benchmark. Its api_url and data_dir
+                   are replaced.
+    :param server_kwargs: keyword arguments of FakeReddit
+    :return: posts/sec, comments/sec, peak memory, the scraper's request
+             metrics and the server's request counts
+    """
+    port = _free_port()
+    url = f'http://127.0.0.1:{port}'
+    server = multiprocessing.Process(target=_serve,
+                                     args=(port, server_kwargs or {}),
+                                     daemon=True)
+    server.start()
+    try:
+        _wait_for_server(url)
+        with tempfile.TemporaryDirectory() as data_dir:
+            config = dataclasses.replace(config, api_url=url,
+                                         data_dir=data_dir)
+            scraper = AsyncRedditScraper(config)
+            tik = time.perf_counter()
+            asyncio.run(scraper.scrape())
+            elapsed = time.perf_counter() - tik
+        with urllib.request.urlopen(f'{url}/_stats') as response:
+            server_stats = json.load(response)
+    finally:
+        server.terminate()
+        server.join()
+
+    posts = sum(data_obj.post_count for data_obj in scraper._data)
+    comments = sum(data_obj.comment_count for data_obj in scraper._data)
+    # ru_maxrss is in kilobytes on linux
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {
+        'subreddits': len(config.subreddit_list),
+        'posts': posts,
+        'comments': comments,
+        'seconds': round(elapsed, 3),
+        'posts_per_sec': round(posts / elapsed, 2),
+        'comments_per_sec': round(comments / elapsed, 2),
+        'peak_memory_mb': round(peak_memory, 1),
+        'failed_requests': len(scraper.failures),
+        'requests': scraper.metrics.to_dict()['request_types'],
+        'server': server_stats
+    }
+
+
+def check_incremental(config: ScraperConfig, server_kwargs: dict = None,
+                      new_comments: int = 5) -> dict:
+    """
+    Scrapes a FakeReddit server twice in incremental mode, adding new_comments
+    comments to every post in between, and checks that the second run appends
+    them.
+
+    Notes:
+        A new comment may only be left out if the second run wrote
+        max_comment_per_post comments of its post, e.g. comments the first
+        run left out because of the limit. Posts should not be cut by
+        max_post_count or max_comment_count.
+
+    :param config: the scraper config. Its api_url, data_dir, checkpoint_path
+                   and incremental are replaced
+    :param server_kwargs: keyword arguments of FakeReddit
+    :return: number of comments added between the runs, written by the second
+             run, left out because of the per-post limit and missing although
+             the limit was not reached
+    """
+    port = _free_port()
+    url = f'http://127.0.0.1:{port}'
+    server = multiprocessing.Process(target=_serve,
+                                     args=(port, server_kwargs or {}),
+                                     daemon=True)
+    server.start()
+    try:
+        _wait_for_server(url)
+        with tempfile.TemporaryDirectory() as data_dir:
+            checkpoint_path = Path(data_dir).joinpath('checkpoint.sqlite')
+            config = dataclasses.replace(config, api_url=url,
+                                         data_dir=data_dir, incremental=True,
+                                         checkpoint_path=str(checkpoint_path))
+            scraper = AsyncRedditScraper(config)
+            asyncio.run(scraper.scrape())
+            first_run = _written_comments(scraper, config)
+            request = urllib.request.Request(
+                f'{url}/_add_comments?count={new_comments}', method='POST')
+            with urllib.request.urlopen(request) as response:
+                added = json.load(response)
+            scraper = AsyncRedditScraper(config)
+            asyncio.run(scraper.scrape())
+            written = _written_comments(scraper, config)
+            is_new = ~written['comment_id'].isin(first_run['comment_id'])
+            second_run = written[is_new]
+    finally:
+        server.terminate()
+        server.join()
+
+    written = set(second_run['comment_id'])
+    per_post = second_run['post_id'].value_counts()
+    left_out = missing = 0
+    for post_id, comment_ids in added.items():
+        not_written = sum(comment_id not in written
+                          for comment_id in comment_ids)
+        if per_post.get(post_id, 0) >= config.max_comment_per_post:
+            left_out += not_written
+        else:
+            missing += not_written
+    return {
+        'added_comments': sum(len(comment_ids)
+                              for comment_ids in added.values()),
+        'second_run_comments': len(second_run),
+        'left_out_comments': left_out,
+        'missing_comments': missing
+    }
+
+
+def _written_comments(scraper: AsyncRedditScraper,
+                      config: ScraperConfig) -> pd.DataFrame:
+    return pd.concat([pd.read_csv(scraper._output_path(subreddit_name,
+                                                       'comments'),
+                                  dtype=str)
+                      for subreddit_name in config.subreddit_list],
+                     ignore_index=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--subreddit', type=str, nargs='+',
+                        default=['computerscience'],
+                        help='Subreddits to scrape from the fake server. '
+                        '"computerscience" by default')
+    parser.add_argument('-o', '--order', type=str, nargs='+', default=['hot'],
+                        help='The order(s) to scrape the data by. "hot" by '
+                        'default')
+    parser.add_argument('-mp', '--maxpost', type=int, default=1000,
+                        help='The maximum number of posts that can be '
+                        'scraped. "1000" by default')
+    parser.add_argument('-mcp', '--maxcommentpost', type=int, default=100,
+                        help='The maximum number comments scraped per post. '
+                        '"100" by default')
+    parser.add_argument('-mc', '--maxcomment', type=int, default=10000,
+                        help='The maximum number comments scraped. "10000" by '
+                        'default')
+    parser.add_argument('-em', '--expandmore', type=int, default=0,
+                        help='Expand "more comments" stubs above this comment '
+                        'depth. "0" by default')
+    parser.add_argument('--rps', type=float, default=1000,
+                        help='Requests per second allowed by the scraper. '
+                        '"1000" by default')
+    parser.add_argument('--posts', type=int, default=200,
+                        help='Number of posts generated per subreddit. "200" '
+                        'by default')
+    parser.add_argument('--comments', type=int, default=20,
+                        help='Average number of comments generated per post. '
+                        '"20" by default')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Average response delay of the fake server in '
+                        'seconds. "0.05" by default')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests the fake server answers '
+                        'with a 503. "0" by default')
+    parser.add_argument('--rate-limit', type=int, default=100000,
+                        help='Requests the fake server allows per rate-limit '
+                        'window. "100000" by default')
+    parser.add_argument('--fixtures', type=str, default=None,
+                        help='Folder with recorded <subreddit>.json files. '
+                        'Generated data by default')
+    parser.add_argument('--max-comments-per-response', type=int, default=200,
+                        help='Comments per comment tree response of the fake '
+                        'server. "200" by default')
+    parser.add_argument('--check-incremental', type=int, default=None,
+                        metavar='NEW_COMMENTS',
+                        help='Instead of the benchmark, scrape twice in '
+                        'incremental mode with NEW_COMMENTS comments added to '
+                        'every post in between and check that all of them '
+                        'are written')
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    config = ScraperConfig(
+        subreddit_list=args.subreddit,
+        scrape_order=args.order[0] if len(args.order) == 1 else args.order,
+        max_post_count=args.maxpost,
+        max_comment_per_post=args.maxcommentpost,
+        max_comment_count=args.maxcomment,
+        expand_more_depth=args.expandmore,
+        requests_per_second=args.rps,
+        request_burst=max(1, int(args.rps))
+    )
+    server_kwargs = {
+        'posts_per_subreddit': args.posts,
+        'comments_per_post': args.comments,
+        'latency': args.latency,
+        'error_rate': args.error_rate,
+        'rate_limit': args.rate_limit,
+        'fixtures': args.fixtures,
+        'max_comments_per_response': args.max_comments_per_response
+    }
+    if args.check_incremental is not None:
+        result = check_incremental(config, server_kwargs,
+                                   args.check_incremental)
+        json.dump(result, sys.stdout, indent=2)
+        print()
+        sys.exit(1 if result['missing_comments'] else 0)
+    json.dump(run_benchmark(config, server_kwargs), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,165 @@
+# checkpoint store for incremental scraping
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    subreddit TEXT NOT NULL,
+    post_id TEXT NOT NULL,
+    num_comments INTEGER NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (subreddit, post_id)
+);
+CREATE TABLE IF NOT EXISTS comments (
+    subreddit TEXT NOT NULL,
+    comment_id TEXT NOT NULL,
+    post_id TEXT NOT NULL,
+    PRIMARY KEY (subreddit, comment_id)
+);
+CREATE INDEX IF NOT EXISTS comments_post ON comments (subreddit, post_id);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_key TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS run_subreddits (
+    run_id INTEGER NOT NULL,
+    subreddit TEXT NOT NULL,
+    finished REAL NOT NULL,
+    PRIMARY KEY (run_id, subreddit)
+);
+"""
+
+
+class CheckpointStore:
+    """
+    SQLite backed record of what previous scrapes have already written to disk.
+
+    Notes:
+        Posts are stored with the num_comments seen on the last scrape so that
+        unchanged posts can be skipped. Comment ids are stored so that only new
+        comments of a changed post are appended.
+
+        Runs are keyed by the scrape order. A run that never called finish_run
+        (e.g. the process crashed) is resumed by the next start_run with the
+        same key, skipping the subreddits it had already finished.
+    """
+
+    def __init__(self, path):
+        """
+        CheckpointStore constructor
+
+        :param path: path to the sqlite database. Created if it does not exist.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # the workers of a sharded scrape share the store, writers wait for
+        # each other
+        self._conn = sqlite3.connect(str(self.path), timeout=60)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def seen_posts(self, subreddit: str) -> Dict[str, int]:
+        """
+        :return: mapping of post_id to the num_comments seen on the last scrape
+        """
+        rows = self._conn.execute(
+            'SELECT post_id, num_comments FROM posts WHERE subreddit = ?',
+            (subreddit,))
+        return dict(rows.fetchall())
+
+    def seen_comments(self, subreddit: str,
+                      post_ids: Iterable[str]) -> Set[str]:
+        """
+        :return: the comment ids already stored for the given posts
+        """
+        seen = set()
+        post_ids = list(post_ids)
+        # stay below sqlite's bound parameter limit
+        for i in range(0, len(post_ids), 500):
+            batch = post_ids[i:i + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = self._conn.execute(
+                f'SELECT comment_id FROM comments '
+                f'WHERE subreddit = ? AND post_id IN ({placeholders})',
+                (subreddit, *batch))
+            seen.update(row[0] for row in rows)
+        return seen
+
+    def record(self, subreddit: str, posts: Iterable[Tuple[str, int]],
+               comments: Iterable[Tuple[str, str]]):
+        """
+        Record posts and comments that have been written to disk, in a single
+        transaction.
+
+        :param subreddit: name of the subreddit
+        :param posts: (post_id, num_comments) pairs
+        :param comments: (comment_id, post_id) pairs
+        """
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                'INSERT INTO posts '
+                '(subreddit, post_id, num_comments, last_seen) '
+                'VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (subreddit, post_id) DO UPDATE SET '
+                'num_comments = excluded.num_comments, '
+                'last_seen = excluded.last_seen',
+                ((subreddit, post_id, int(num_comments), now)
+                 for post_id, num_comments in posts))
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO comments '
+                '(subreddit, comment_id, post_id) VALUES (?, ?, ?)',
+                ((subreddit, comment_id, post_id)
+                 for comment_id, post_id in comments))
+
+    def start_run(self, run_key: str) -> Tuple[int, Set[str]]:
+        """
+        Start a new run, or resume the last unfinished run with the same key.
+
+        :param run_key: key identifying the kind of run, e.g. the scrape order
+        :return: the run id and the subreddits the run has already finished
+        """
+        row = self._conn.execute(
+            'SELECT run_id, finished FROM runs WHERE run_key = ? '
+            'ORDER BY run_id DESC LIMIT 1',
+            (run_key,)).fetchone()
+        if row is not None and row[1] is None:
+            run_id = row[0]
+            done = self._conn.execute(
+                'SELECT subreddit FROM run_subreddits WHERE run_id = ?',
+                (run_id,))
+            return run_id, {r[0] for r in done}
+        with self._conn:
+            cursor = self._conn.execute(
+                'INSERT INTO runs (run_key, started) VALUES (?, ?)',
+                (run_key, time.time()))
+        return cursor.lastrowid, set()
+
+    def finish_subreddit(self, run_id: int, subreddit: str):
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO run_subreddits '
+                '(run_id, subreddit, finished) VALUES (?, ?, ?)',
+                (run_id, subreddit, time.time()))
+
+    def finish_run(self, run_id: Optional[int]):
+        if run_id is None:
+            return
+        with self._conn:
+            self._conn.execute(
+                'UPDATE runs SET finished = ? WHERE run_id = ?',
+                (time.time(), run_id))
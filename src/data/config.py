@@ -1,15 +1,70 @@
 # config file for scraper
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional, Union
 
 
 @dataclass(frozen=True)
 class ScraperConfig:
     subreddit_list: List[str]  # list of subreddits to scrape
-    scrape_order: str  # order to scrape the data from. Can take values: 'hot', 'new', 'top', 'rising'. Notes: 'top' scrapes top of all time.
+    # order to scrape the data from. Can take values: 'hot', 'new', 'top',
+    # 'rising', or a list of them. Notes: 'top' scrapes top of all time.
+    scrape_order: Union[str, List[str]]
     max_post_count: int  # number of hot posts to retrieve
     max_comment_per_post: int  # number of top comments associated with each retrieved post
     max_comment_count: int  # total number of comments for the subreddit
+    # skip posts unchanged since the last scrape and append only new
+    # posts/comments
+    incremental: bool = False
+    # seen-id store used by incremental mode, relative to project root
+    checkpoint_path: str = 'data/checkpoint.sqlite'
+    # maximum number of concurrent comment requests across all subreddits
+    max_in_flight: int = 16
+    # maximum number of concurrent comment requests per reddit session
+    max_in_flight_per_session: int = 8
+    # token bucket refill rate, lowered further by the API's rate-limit headers
+    requests_per_second: float = 1.0
+    # number of requests that can be sent at once after an idle period
+    request_burst: int = 10
+    # number of reddit sessions shared by all subreddits of a scrape
+    session_pool_size: int = 1
+    # seconds an idle connection is kept open for reuse
+    keepalive_timeout: float = 60
+    # number of scraped rows buffered in memory before they are written to disk
+    flush_rows: int = 1000
+    # expand "more comments" stubs breadth-first above this comment depth, 0
+    # drops them
+    expand_more_depth: int = 0
+    # folder the raw/ and results/ files are written to, relative to project
+    # root
+    data_dir: str = 'data'
+    # base url of a reddit API stand-in (see fake_reddit.py) instead of
+    # reddit.com
+    api_url: Optional[str] = None
+    # seconds between progress reports of the request queue during a run
+    metrics_interval: float = 30
+    # fraction of the API quota reported in the rate-limit headers this scraper
+    # may use
+    quota_share: float = 1.0
+    # name of the shard of a sharded scrape (see sharded.py), added to the
+    # metrics file name
+    shard: Optional[str] = None
+    # also write the raw API responses to data_dir/archive, see archive.py
+    archive: bool = False
+    # also append a request metrics snapshot to results/*_metrics.jsonl every
+    # metrics_interval
+    stream_metrics: bool = False
+
+    @property
+    def scrape_orders(self) -> List[str]:
+        """the scrape orders as a list, also when a single order is given"""
+        if isinstance(self.scrape_order, str):
+            return [self.scrape_order]
+        return list(self.scrape_order)
+
+    @property
+    def order_tag(self) -> str:
+        """the scrape orders as used in file names, e.g. 'hot' or 'hot-new'"""
+        return '-'.join(self.scrape_orders)
 
 
 default_config = scraper_config = ScraperConfig(
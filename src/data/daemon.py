@@ -0,0 +1,330 @@
+# long-running scraper that re-scrapes subreddits according to their activity
+import math
+import argparse
+import asyncio
+import dataclasses
+import json
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from src.utils import get_project_root
+from checkpoint import CheckpointStore
+from config import ScraperConfig
+from scraper import AsyncRedditScraper, logger
+
+
+@dataclass
+class SubredditSchedule:
+    name: str
+    # new comments per hour, exponentially smoothed
+    velocity: Optional[float] = None
+    # HTTP requests per scrape, exponentially smoothed
+    cost: Optional[float] = None
+    last_scraped: Optional[float] = None  # unix time of the last scrape
+    next_due: float = 0.0  # unix time of the next scrape
+    scrapes: int = 0
+    # consecutive failed scrapes, each one doubles the retry interval
+    failures: int = 0
+
+
+class ScrapeDaemon:
+    """
+    Re-scrapes a list of subreddits in incremental mode, each at an interval
+    set by its comment velocity, while keeping the expected request rate
+    within a global budget.
+
+    Notes:
+        Scraping subreddit i every d_i hours costs c_i requests per scrape
+        and leaves on average v_i * d_i / 2 comments unscraped, where v_i is
+        the comment velocity. Minimizing the unscraped comments over all
+        subreddits subject to sum(c_i / d_i) = budget gives
+
+            d_i = sqrt(c_i / v_i) * sum_j(sqrt(c_j * v_j)) / budget
+
+        so busy subreddits are scraped more often and quiet or expensive ones
+        less, without spending more requests than a fixed interval would.
+        Intervals are clamped to [min_interval, max_interval]. Subreddits
+        without a velocity estimate yet are scraped again after min_interval,
+        their requests (at the average cost of a scrape) are taken from the
+        budget before it is split among the others.
+
+        The velocity is measured from the growth of the num_comments of the
+        posts in the checkpoint store between two scrapes, not from the
+        comments written, which max_comment_per_post and max_comment_count
+        cap.
+
+        A subreddit whose scrape failed, e.g. with a network outage, is
+        retried after min_interval, doubled with every consecutive failure up
+        to max_interval. Its estimates are left untouched.
+
+        The schedule is kept in a JSON state file, so a restarted daemon
+        continues where it stopped.
+
+    Usage:
+        daemon = ScrapeDaemon(config, requests_per_hour=3000)
+        asyncio.run(daemon.run())
+    """
+
+    def __init__(self, config: ScraperConfig, requests_per_hour: float,
+                 min_interval: float = 600, max_interval: float = 86400,
+                 smoothing: float = 0.5,
+                 state_path: str = 'data/schedule.json'):
+        """
+        ScrapeDaemon constructor
+
+        :param config: the scraper config, its subreddit_list is the list to
+                       keep fresh
+        :param requests_per_hour: the request budget of all subreddits together
+        :param min_interval: minimum seconds between two scrapes of a subreddit
+        :param max_interval: maximum seconds between two scrapes of a subreddit
+        :param smoothing: weight of the latest observation in the velocity and
+                          cost estimates
+        :param state_path: schedule state file, relative to project root
+        """
+        self.config = dataclasses.replace(config, incremental=True)
+        self.requests_per_hour = requests_per_hour
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.smoothing = smoothing
+        self.state_path = get_project_root().joinpath(state_path)
+        self.schedule: Dict[str, SubredditSchedule] = {
+            name: SubredditSchedule(name) for name in config.subreddit_list}
+        self._load_state()
+
+    def _load_state(self):
+        if not self.state_path.exists():
+            return
+        with open(self.state_path) as f:
+            for entry in json.load(f):
+                if entry['name'] in self.schedule:
+                    self.schedule[entry['name']] = SubredditSchedule(**entry)
+
+    def _save_state(self):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_name(self.state_path.name + '.part')
+        with open(tmp_path, 'w') as f:
+            json.dump([dataclasses.asdict(entry)
+                       for entry in self.schedule.values()], f, indent=2)
+        tmp_path.replace(self.state_path)
+
+    def _smooth(self, previous: Optional[float], observed: float) -> float:
+        if previous is None:
+            return observed
+        return self.smoothing * observed + (1 - self.smoothing) * previous
+
+    def intervals(self) -> Dict[str, float]:
+        """
+        :return: seconds until the next scrape of every subreddit, see the
+                 class notes
+        """
+        # a subreddit without new comments still gets a small velocity, so it
+        # is scraped at max_interval at worst
+        estimated = {name: (max(entry.velocity, 0.1), max(entry.cost, 1.0))
+                     for name, entry in self.schedule.items()
+                     if entry.velocity is not None and entry.cost is not None}
+        total = sum(math.sqrt(cost * velocity)
+                    for velocity, cost in estimated.values())
+        # subreddits without estimates are scraped every min_interval, charged
+        # at their own cost if they have been scraped once or else at the
+        # average cost of a scrape
+        costs = [entry.cost for entry in self.schedule.values()
+                 if entry.cost is not None]
+        default_cost = max(sum(costs) / len(costs), 1.0) if costs else 1.0
+        reserved = sum(
+            default_cost if entry.cost is None else max(entry.cost, 1.0)
+            for name, entry in self.schedule.items() if name not in estimated)
+        budget = self.requests_per_hour - reserved * 3600 / self.min_interval
+        intervals = {}
+        for name in self.schedule:
+            if name not in estimated:
+                intervals[name] = self.min_interval
+                continue
+            if budget <= 0:
+                intervals[name] = self.max_interval
+                continue
+            velocity, cost = estimated[name]
+            hours = math.sqrt(cost / velocity) * total / budget
+            intervals[name] = min(self.max_interval,
+                                  max(self.min_interval, hours * 3600))
+        return intervals
+
+    def _comment_counts(self,
+                        subreddits: List[str]) -> Dict[str, Dict[str, int]]:
+        """
+        :return: the num_comments of the posts in the checkpoint store, per
+                 subreddit
+        """
+        checkpoint_path = get_project_root().joinpath(
+            self.config.checkpoint_path)
+        with CheckpointStore(checkpoint_path) as store:
+            return {name: store.seen_posts(name) for name in subreddits}
+
+    @staticmethod
+    def _comment_growth(before: Dict[str, int], after: Dict[str, int]) -> int:
+        """
+        :return: comments added to the posts between two scrapes, posts seen
+                 for the first time count with all their comments
+        """
+        return sum(max(count - before.get(post_id, 0), 0)
+                   for post_id, count in after.items())
+
+    def _update(self, scraper: AsyncRedditScraper, started: float,
+                scraped: List[str], counts_before: Dict[str, Dict[str, int]]):
+        """
+        :param scraped: the subreddits that were scraped successfully
+        :param counts_before: the num_comments of the posts before the scrape,
+                              see _comment_counts()
+        """
+        counts_after = self._comment_counts(scraped)
+        requests = scraper.metrics.to_dict()['subreddits']
+        scraped_data = [data_obj for data_obj in scraper._data
+                        if data_obj.name in scraped]
+        for data_obj in scraped_data:
+            entry = self.schedule[data_obj.name]
+            cost = sum(stats['http_requests'] for stats
+                       in requests.get(data_obj.name, {}).values())
+            entry.cost = self._smooth(entry.cost, cost)
+            # the first scrape returns the whole backlog, velocity is only
+            # measured from the second one on
+            if entry.last_scraped is not None:
+                hours = max(started - entry.last_scraped, 1.0) / 3600
+                growth = self._comment_growth(counts_before[data_obj.name],
+                                              counts_after[data_obj.name])
+                entry.velocity = self._smooth(entry.velocity, growth / hours)
+            entry.last_scraped = started
+            entry.scrapes += 1
+            entry.failures = 0
+        intervals = self.intervals()
+        for data_obj in scraped_data:
+            self.schedule[data_obj.name].next_due = (
+                started + intervals[data_obj.name])
+
+    def _back_off(self, failed: List[str], started: float):
+        for name in failed:
+            entry = self.schedule[name]
+            entry.failures += 1
+            delay = min(self.max_interval,
+                        self.min_interval * 2 ** (entry.failures - 1))
+            entry.next_due = started + delay
+            logger.warning(f'{name}: scrape failed {entry.failures} time(s) '
+                           f'in a row, retrying in {round(delay / 60, 1)} '
+                           f'minutes')
+
+    def due(self, now: float) -> List[str]:
+        """
+        :return: the subreddits due for a scrape, most active first
+        """
+        due = [entry for entry in self.schedule.values()
+               if entry.next_due <= now]
+        # subreddits without a velocity estimate yet come first
+        return [entry.name for entry in sorted(
+            due, key=lambda entry: (-math.inf if entry.velocity is None
+                                    else -entry.velocity))]
+
+    async def run_once(self) -> List[str]:
+        """
+        Scrapes the subreddits that are due, all in one incremental scrape.
+
+        :return: the scraped subreddits
+        """
+        started = time.time()
+        due = self.due(started)
+        if not due:
+            return []
+        counts_before = self._comment_counts(due)
+        scraper = AsyncRedditScraper(dataclasses.replace(self.config,
+                                                         subreddit_list=due))
+        try:
+            await scraper.scrape()
+            scraper.save_to_file()
+        except Exception as e:
+            # e.g. the session could not be set up, no subreddit of the round
+            # was scraped
+            logger.error(f'scrape of {", ".join(due)} failed: {e!r}')
+            self._back_off(due, started)
+            self._save_state()
+            return due
+        # subreddits whose scrape failed are recorded by the scraper, see
+        # _fetch_from_single_subreddit
+        failed = {failure['subreddit'] for failure in scraper.failures
+                  if failure['stage'] == 'subreddit'}
+        scraped = [data_obj.name for data_obj in scraper._data
+                   if data_obj.name not in failed]
+        self._update(scraper, started, scraped, counts_before)
+        self._back_off([name for name in due if name in failed], started)
+        for name in due:
+            if name not in failed and name not in scraped:
+                # already finished by the interrupted run the scrape resumed
+                self.schedule[name].next_due = started + self.min_interval
+        self._save_state()
+        for data_obj in scraper._data:
+            if data_obj.name not in scraped:
+                continue
+            entry = self.schedule[data_obj.name]
+            velocity = ('unknown' if entry.velocity is None
+                        else round(entry.velocity, 1))
+            minutes = round((entry.next_due - time.time()) / 60, 1)
+            logger.info(f'{data_obj.name}: {data_obj.comment_count} new '
+                        f'comments, {velocity} comments/hour, next scrape in '
+                        f'{minutes} minutes')
+        return due
+
+    async def run(self, rounds: Optional[int] = None):
+        """
+        Scrapes due subreddits and sleeps until the next one is due, forever
+        or for `rounds` scrapes.
+        """
+        completed = 0
+        while rounds is None or completed < rounds:
+            if await self.run_once():
+                completed += 1
+            next_due = min(entry.next_due for entry in self.schedule.values())
+            await asyncio.sleep(max(0.0, next_due - time.time()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--subredditfile', type=str,
+                        default='pages/subreddit_list.txt',
+                        help='File with one subreddit per line, relative to '
+                        'the project root. "pages/subreddit_list.txt" by '
+                        'default')
+    parser.add_argument('-o', '--order', type=str, nargs='+', default=['hot'],
+                        help='The order(s) to scrape the data by. "hot" by '
+                        'default')
+    parser.add_argument('-mp', '--maxpost', type=int, default=1000,
+                        help='The maximum number of posts that can be scraped '
+                        'per subreddit. "1000" by default')
+    parser.add_argument('-mcp', '--maxcommentpost', type=int, default=100,
+                        help='The maximum number comments scraped per post. '
+                        '"100" by default')
+    parser.add_argument('-mc', '--maxcomment', type=int, default=10000,
+                        help='The maximum number comments scraped per '
+                        'subreddit. "10000" by default')
+    parser.add_argument('-b', '--budget', type=float, default=1800,
+                        help='Requests per hour spent on all subreddits '
+                        'together. "1800" by default')
+    parser.add_argument('--min-interval', type=float, default=10,
+                        help='Minimum minutes between two scrapes of a '
+                        'subreddit. "10" by default')
+    parser.add_argument('--max-interval', type=float, default=1440,
+                        help='Maximum minutes between two scrapes of a '
+                        'subreddit. "1440" by default')
+    parser.add_argument('--rounds', type=int, default=None,
+                        help='Stop after this many scrapes. Runs forever by '
+                        'default')
+    args = parser.parse_args()
+
+    with open(get_project_root().joinpath(args.subredditfile)) as f:
+        subreddit_list = [line.strip() for line in f if line.strip()]
+    config = ScraperConfig(
+        subreddit_list=subreddit_list,
+        scrape_order=args.order[0] if len(args.order) == 1 else args.order,
+        max_post_count=args.maxpost,
+        max_comment_per_post=args.maxcommentpost,
+        max_comment_count=args.maxcomment
+    )
+    daemon = ScrapeDaemon(config, args.budget, args.min_interval * 60,
+                          args.max_interval * 60)
+    asyncio.run(daemon.run(args.rounds))
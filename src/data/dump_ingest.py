@@ -0,0 +1,364 @@
+# offline ingestion of reddit archive dumps (zstd compressed NDJSON)
+import sys
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import pandas as pd
+import zstandard
+
+from src.utils import get_project_root
+from schema import (SUBREDDIT_COLUMNS, POST_COLUMNS, COMMENT_COLUMNS,
+                    subreddit_row, post_row, comment_row)
+from sink import CsvSink
+
+# logger setup
+handler = logging.StreamHandler(sys.stdout)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(handler)
+
+# values of fields the scraper reads that older dumps do not have
+_POST_DEFAULTS = {'link_flair_text': None, 'upvote_ratio': None, 'url': None,
+                  'selftext': '', 'num_comments': 0, 'score': 0}
+_COMMENT_DEFAULTS = {'controversiality': 0, 'total_awards_received': 0,
+                     'locked': False, 'collapsed': False,
+                     'is_submitter': False}
+
+
+def iter_batches(path, batch_bytes: int = 16 * 2 ** 20) -> Iterator[bytes]:
+    """
+    Decompresses a zstd NDJSON dump as a stream.
+
+    :param batch_bytes: approximate size of the yielded batches
+    :return: batches of complete lines
+    """
+    # the monthly dumps are compressed with a long window
+    decompressor = zstandard.ZstdDecompressor(max_window_size=2 ** 31)
+    with open(path, 'rb') as f, decompressor.stream_reader(f) as reader:
+        rest = b''
+        while True:
+            chunk = reader.read(batch_bytes)
+            if not chunk:
+                break
+            chunk = rest + chunk
+            end = chunk.rfind(b'\n') + 1
+            rest = chunk[end:]
+            if end:
+                yield chunk[:end]
+        if rest.strip():
+            yield rest
+
+
+def _scraped(data: dict) -> bool:
+    """
+    Applies the filters of the scraper to a post or comment of a dump:
+    stickied posts and comments (moderator announcements, AutoModerator's
+    pinned notices) are dropped, and so are posts that were removed or
+    deleted, which do not appear in the listings the scraper reads.
+    """
+    if data.get('stickied'):
+        return False
+    if ('stickied' not in data and data.get('author') == 'AutoModerator'
+            and data.get('distinguished')):
+        # older dumps have no stickied field, AutoModerator's pinned comments
+        # are distinguished instead
+        return False
+    if 'link_id' not in data:
+        return (not data.get('removed_by_category')
+                and data.get('selftext') not in ('[removed]', '[deleted]'))
+    return True
+
+
+def _parse_line(line: bytes, subreddits: Dict[str, str], start: float,
+                end: float) -> Optional[Tuple[str, dict]]:
+    """
+    :return: the output subreddit name and the JSON of a line, None if the
+        line cannot be parsed or is of another subreddit or time range
+    """
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    name = subreddits.get(str(data.get('subreddit', '')).lower())
+    if name is None:
+        return None
+    created = float(data.get('created_utc') or 0)
+    if not start <= created < end:
+        return None
+    return name, data
+
+
+def _post_record(data: dict, name: str, tag: str,
+                 skipped: List[str]) -> Optional[tuple]:
+    """
+    :return: the row of a submission, None if the scraper would not have
+        scraped it, see _scraped(). Its id is then added to skipped
+    """
+    if not _scraped(data):
+        skipped.append(data['id'])
+        return None
+    return (name, 'posts', post_row(_post(data), name, [tag]),
+            data.get('subreddit_subscribers'))
+
+
+def _comment_record(data: dict, name: str) -> Optional[tuple]:
+    """
+    :return: the row of a comment, None if the scraper would not have
+        scraped it, see _scraped()
+    """
+    if not _scraped(data):
+        return None
+    return name, 'comments', comment_row(_comment(data), name), None
+
+
+def _parse_batch(batch: bytes, subreddits: Dict[str, str], start: float,
+                 end: float, tag: str) -> Tuple[List[tuple], List[str]]:
+    """
+    Parses the lines of a batch that belong to one of the subreddits and
+    the time range into rows.
+
+    :param subreddits: mapping of lower case subreddit names to the names
+        used in the output files
+    :param tag: listings value of the post rows
+    :return: (subreddit name, 'posts' or 'comments', row, subreddit
+        subscribers) tuples, and the ids of the posts of the batch the
+        scraper would not have scraped, see _scraped()
+    """
+    needles = [f'"{name}"'.encode() for name in subreddits]
+    records = []
+    skipped = []
+    # bytes.lower() only changes ascii letters, so the lines of both batches
+    # line up
+    for line, lowered in zip(batch.split(b'\n'), batch.lower().split(b'\n')):
+        # most lines belong to other subreddits, skip them without parsing
+        # the JSON
+        if not any(needle in lowered for needle in needles):
+            continue
+        parsed = _parse_line(line, subreddits, start, end)
+        if parsed is None:
+            continue
+        name, data = parsed
+        if 'link_id' in data:
+            record = _comment_record(data, name)
+        else:
+            record = _post_record(data, name, tag, skipped)
+        if record is not None:
+            records.append(record)
+    return records, skipped
+
+
+def _post(data: dict) -> SimpleNamespace:
+    return SimpleNamespace(**{**_POST_DEFAULTS,
+                              'created': data.get('created_utc'), **data})
+
+
+def _comment(data: dict) -> SimpleNamespace:
+    return SimpleNamespace(**{**_COMMENT_DEFAULTS, 'ups': data.get('score'),
+                              **data},
+                           submission=SimpleNamespace(id=data['link_id'][3:]))
+
+
+class DumpIngester:
+    """
+    Streams reddit archive dumps into the posts and comments files the
+    scraper writes.
+
+    Notes:
+        The dumps are decompressed in the calling process and batches of
+        lines are parsed and filtered in a process pool. Only a few batches
+        are in flight at a time and rows are streamed to CsvSinks, so memory
+        stays constant regardless of the dump size.
+
+        Posts and comments the scraper skips are dropped too, see _scraped().
+        Comments of dropped posts are only dropped if the submissions dump is
+        ingested before the comments dump.
+
+        The files are named like the scraper's with the order tag replaced by
+        `tag`, e.g. data/raw/computerscience_dump_posts.csv, so they can be
+        analyzed with SubredditAnalysis(subreddit, sort_order='dump').
+
+    Usage:
+        with DumpIngester(['computerscience'], start='2021-01-01',
+                          end='2021-07-01') as ingester:
+            ingester.ingest('RS_2021-01.zst')
+            ingester.ingest('RC_2021-01.zst')
+    """
+
+    def __init__(self, subreddit_list: List[str], start: Optional[str] = None,
+                 end: Optional[str] = None, tag: str = 'dump',
+                 data_dir: str = 'data', workers: int = 4,
+                 append: bool = False, flush_rows: int = 10000):
+        """
+        DumpIngester constructor
+
+        :param subreddit_list: subreddits to keep, matched case-insensitively
+        :param start: first day to keep, YYYY-MM-DD in UTC. No lower bound by
+            default
+        :param end: first day not to keep, YYYY-MM-DD in UTC. No upper bound
+            by default
+        :param tag: replaces the scrape order in the file names
+        :param data_dir: folder the raw/ and results/ files are written to,
+            relative to project root
+        :param workers: number of parsing processes
+        :param append: add the rows to existing files instead of replacing
+            them
+        :param flush_rows: number of rows buffered in memory before they are
+            written to disk
+        """
+        self.subreddits = {name.lower(): name for name in subreddit_list}
+        self.start = self._timestamp(start) if start else float('-inf')
+        self.end = self._timestamp(end) if end else float('inf')
+        self.tag = tag
+        self.data_dir = data_dir
+        self.workers = workers
+        self.append = append
+        self.flush_rows = flush_rows
+        self.counts = {name: {'posts': 0, 'comments': 0}
+                       for name in subreddit_list}
+        self._sinks = {}
+        self._subscribers = {}
+        self._skipped_posts: Set[str] = set()
+
+    @staticmethod
+    def _timestamp(day: str) -> float:
+        utc_day = datetime.strptime(day, '%Y-%m-%d').replace(
+            tzinfo=timezone.utc)
+        return utc_day.timestamp()
+
+    def _output_path(self, subreddit_name: str, kind: str) -> Path:
+        folder = 'results' if kind == 'subreddit' else 'raw'
+        p = get_project_root().joinpath(self.data_dir, folder)
+        p.mkdir(parents=True, exist_ok=True)
+        return p.joinpath(f'{subreddit_name}_{self.tag}_{kind}.csv')
+
+    def _sink(self, subreddit_name: str, kind: str) -> CsvSink:
+        key = (subreddit_name, kind)
+        if key not in self._sinks:
+            columns = POST_COLUMNS if kind == 'posts' else COMMENT_COLUMNS
+            self._sinks[key] = CsvSink(self._output_path(subreddit_name, kind),
+                                       columns, append=self.append,
+                                       buffer_rows=self.flush_rows)
+        return self._sinks[key]
+
+    def _write(self, records: List[tuple], skipped: List[str]) -> int:
+        """
+        Writes the records of a batch, except the comments of the posts the
+        scraper would not have scraped.
+
+        :return: number of rows written
+        """
+        self._skipped_posts.update(skipped)
+        written = 0
+        for name, kind, row, subscribers in records:
+            # row[0] is the post id of a comment row, see COMMENT_COLUMNS
+            if kind == 'comments' and row[0] in self._skipped_posts:
+                continue
+            self._sink(name, kind).write(row)
+            if subscribers is not None:
+                self._subscribers[name] = subscribers
+            self.counts[name][kind] += 1
+            written += 1
+        return written
+
+    def ingest(self, path) -> dict:
+        """
+        Streams one dump file, submissions or comments, into the output
+        files.
+
+        :return: bytes decompressed, lines read, rows kept and MB/s
+        """
+        tik = time.perf_counter()
+        decompressed = lines = kept = 0
+        window = deque()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for batch in iter_batches(path):
+                decompressed += len(batch)
+                lines += batch.count(b'\n')
+                window.append(executor.submit(
+                    _parse_batch, batch, self.subreddits, self.start,
+                    self.end, self.tag))
+                # keep the workers busy but do not read ahead further
+                while len(window) > 2 * self.workers:
+                    kept += self._write(*window.popleft().result())
+            while window:
+                kept += self._write(*window.popleft().result())
+        elapsed = time.perf_counter() - tik
+        decompressed_mb = decompressed / 2 ** 20
+        stats = {'file': str(path),
+                 'decompressed_mb': round(decompressed_mb, 1),
+                 'lines': lines, 'kept': kept, 'seconds': round(elapsed, 2),
+                 'mb_per_sec': (round(decompressed_mb / elapsed, 1)
+                                if elapsed else None)}
+        logger.info(f'ingested {stats}')
+        return stats
+
+    def commit(self):
+        """
+        Commits the posts and comments files, and writes a subreddit summary
+        for every subreddit with posts.
+        """
+        for sink in self._sinks.values():
+            sink.commit()
+        self._sinks = {}
+        for name, subscribers in self._subscribers.items():
+            row = subreddit_row(SimpleNamespace(display_name=name,
+                                                public_description=None,
+                                                subscribers=subscribers),
+                                name)
+            pd.DataFrame([row], columns=SUBREDDIT_COLUMNS).to_csv(
+                self._output_path(name, 'subreddit'), index=False)
+
+    def discard(self):
+        for sink in self._sinks.values():
+            sink.discard()
+        self._sinks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', type=str, nargs='+',
+                        help='Dump files (e.g. RS_2021-01.zst and '
+                        'RC_2021-01.zst) in chronological order')
+    parser.add_argument('-s', '--subreddit', type=str, nargs='+',
+                        required=True,
+                        help='Subreddits to keep')
+    parser.add_argument('--start', type=str, default=None,
+                        help='First day to keep, YYYY-MM-DD. No lower bound '
+                        'by default')
+    parser.add_argument('--end', type=str, default=None,
+                        help='First day not to keep, YYYY-MM-DD. No upper '
+                        'bound by default')
+    parser.add_argument('-t', '--tag', type=str, default='dump',
+                        help='Replaces the scrape order in the output file '
+                        'names. "dump" by default')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='Number of parsing processes. "4" by default')
+    parser.add_argument('--append', default=False, action='store_true',
+                        help='Add the rows to existing files instead of '
+                        'replacing them. "False" by default')
+    args = parser.parse_args()
+
+    with DumpIngester(args.subreddit, args.start, args.end, args.tag,
+                      workers=args.workers, append=args.append) as ingester:
+        for file in args.files:
+            ingester.ingest(file)
+    for name, counts in ingester.counts.items():
+        logger.info(f'Subreddit {name} ingested {counts["posts"]} posts and '
+                    f'{counts["comments"]} comments.')
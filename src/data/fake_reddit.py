@@ -0,0 +1,424 @@
+# local stand-in for the reddit API, used to benchmark and test the scraper
+# without hitting reddit
+import argparse
+import asyncio
+import json
+import random
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+ORDERS = ('hot', 'new', 'top', 'rising')
+
+
+def _base36(number: int) -> str:
+    chars = '0123456789abcdefghijklmnopqrstuvwxyz'
+    digits = ''
+    while True:
+        number, remainder = divmod(number, 36)
+        digits = chars[remainder] + digits
+        if number == 0:
+            return digits
+
+
+class FakeReddit:
+    """
+    aiohttp application serving the subset of the reddit API the scraper uses:
+    token, subreddit about, listings, comment trees, morechildren and info.
+
+    Notes:
+        Subreddits are either generated deterministically from the seed, or
+        loaded from '<subreddit>.json' files in the fixtures folder with the
+        keys 'about', 'posts' and 'comments' (flat lists of reddit 'data'
+        objects, comments are nested by their parent_id).
+
+        Like reddit, a comment tree response holds at most
+        `max_comments_per_response` comments, the rest of the tree is replaced
+        by "more comments" stubs that can be expanded with /api/morechildren.
+
+        Every response is delayed by `latency` seconds, fails with a 503 with
+        probability `error_rate` and carries x-ratelimit-* headers of a fixed
+        window. Requests over the quota get a 429.
+    """
+
+    def __init__(self, posts_per_subreddit: int = 100,
+                 comments_per_post: int = 20, latency: float = 0.05,
+                 error_rate: float = 0.0, rate_limit: int = 600,
+                 rate_limit_window: int = 600, fixtures: Optional[str] = None,
+                 seed: int = 0, max_comments_per_response: int = 200):
+        """
+        FakeReddit constructor
+
+        :param posts_per_subreddit: number of posts generated per subreddit
+        :param comments_per_post: average number of comments generated per
+            post
+        :param latency: average response delay in seconds
+        :param error_rate: fraction of requests answered with a 503
+        :param rate_limit: number of requests allowed per rate-limit window
+        :param rate_limit_window: length of the rate-limit window in seconds
+        :param fixtures: folder with recorded subreddits, generated subreddits
+            are used for any other name
+        :param seed: seed of the generated data and of the injected errors
+        :param max_comments_per_response: number of comments in a comment tree
+            response before the remaining comments are replaced by "more
+            comments" stubs
+        """
+        self.posts_per_subreddit = posts_per_subreddit
+        self.comments_per_post = comments_per_post
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.fixtures = Path(fixtures) if fixtures else None
+        self.seed = seed
+        self.max_comments_per_response = max_comments_per_response
+        self._random = random.Random(seed)
+        self._subreddits: Dict[str, dict] = {}
+        self._posts: Dict[str, dict] = {}
+        self._comment_index: Dict[str, dict] = {}
+        self._window_start = time.monotonic()
+        self._used = 0
+        self.stats = {'requests': 0, 'errors': 0, 'throttled': 0}
+
+    # data
+
+    def _subreddit(self, name: str) -> dict:
+        if name.lower() not in self._subreddits:
+            fixture = (self.fixtures.joinpath(f'{name}.json')
+                       if self.fixtures else None)
+            if fixture is not None and fixture.exists():
+                with open(fixture) as f:
+                    data = json.load(f)
+            else:
+                data = self._generate(name)
+            self._add(name, data)
+        return self._subreddits[name.lower()]
+
+    def _generate(self, name: str) -> dict:
+        rng = random.Random(f'{self.seed}-{name}')
+        now = time.time()
+        posts = []
+        comments = []
+        for i in range(self.posts_per_subreddit):
+            post_id = _base36(rng.getrandbits(40))
+            num_comments = rng.randint(0, 2 * self.comments_per_post)
+            created = now - rng.uniform(0, 7 * 24 * 3600)
+            posts.append({
+                'id': post_id,
+                'name': f't3_{post_id}',
+                'title': f'{name} post {i}',
+                'selftext': ' '.join(rng.choice(_WORDS)
+                                     for _ in range(rng.randint(0, 80))),
+                'link_flair_text': rng.choice([None, 'Discussion',
+                                               'Question']),
+                'score': rng.randint(0, 5000),
+                'upvote_ratio': round(rng.uniform(0.5, 1), 2),
+                'url': f'https://www.reddit.com/r/{name}/comments/{post_id}/',
+                'permalink': f'/r/{name}/comments/{post_id}/',
+                'num_comments': num_comments,
+                'created': created,
+                'created_utc': created,
+                'stickied': i == 0,
+                'subreddit': name,
+                'author': f'user{rng.randint(0, 999)}'
+            })
+            ids = []
+            for _ in range(num_comments):
+                comment = self._new_comment(rng, posts[-1], ids)
+                ids.append(comment['id'])
+                comments.append(comment)
+        about = {'display_name': name,
+                 'public_description': f'generated subreddit {name}',
+                 'subscribers': rng.randint(1000, 10 ** 7),
+                 'id': _base36(rng.getrandbits(30))}
+        about['name'] = f't5_{about["id"]}'
+        return {'about': about, 'posts': posts, 'comments': comments}
+
+    @staticmethod
+    def _new_comment(rng: random.Random, post: dict, ids: List[str]) -> dict:
+        """
+        :param ids: ids of the earlier comments of the post, a comment replies
+                    to one of them or to the post
+        """
+        comment_id = _base36(rng.getrandbits(40))
+        if ids and rng.random() < 0.6:
+            parent_id = f't1_{rng.choice(ids)}'
+        else:
+            parent_id = f't3_{post["id"]}'
+        return {
+            'id': comment_id,
+            'name': f't1_{comment_id}',
+            'link_id': f't3_{post["id"]}',
+            'parent_id': parent_id,
+            'body': ' '.join(rng.choice(_WORDS)
+                             for _ in range(rng.randint(1, 60))),
+            'ups': rng.randint(-20, 500),
+            'score': rng.randint(-20, 500),
+            'controversiality': int(rng.random() < 0.1),
+            'total_awards_received': 0,
+            'locked': False,
+            'collapsed': False,
+            'is_submitter': rng.random() < 0.05,
+            'stickied': False,
+            'created_utc': post['created_utc'] + rng.uniform(0, 3600),
+            'subreddit': post['subreddit'],
+            'author': f'user{rng.randint(0, 999)}'
+        }
+
+    def add_comments(self, count: int) -> Dict[str, List[str]]:
+        """
+        Adds count new top-level comments to every non-stickied post served so
+        far, like the activity between two scrapes, and updates their
+        num_comments.
+
+        :return: mapping of post id to the ids of its new comments
+        """
+        added = {}
+        for post_id, entry in self._posts.items():
+            post = entry['post']
+            if post.get('stickied'):
+                continue
+            added[post_id] = []
+            for _ in range(count):
+                comment = self._new_comment(self._random, post, [])
+                entry['children'].setdefault(post['name'], []).append(comment)
+                self._comment_index[comment['id']] = comment
+                added[post_id].append(comment['id'])
+            post['num_comments'] += count
+        return added
+
+    def _add(self, name: str, data: dict):
+        children = {}
+        for comment in data['comments']:
+            children.setdefault(comment['parent_id'], []).append(comment)
+        posts = data['posts']
+        listings = {
+            'new': sorted(posts, key=lambda p: -p['created_utc']),
+            'top': sorted(posts, key=lambda p: -p['score']),
+            'hot': sorted(posts, key=lambda p: -p['score'] / (
+                time.time() - p['created_utc'] + 7200) ** 1.5),
+        }
+        listings['rising'] = listings['new'][:25]
+        self._subreddits[name.lower()] = {'about': data['about'],
+                                          'listings': listings,
+                                          'children': children}
+        for post in posts:
+            self._posts[post['id']] = {'post': post, 'children': children}
+        for comment in data['comments']:
+            self._comment_index[comment['id']] = comment
+
+    @staticmethod
+    def _thing(kind: str, data: dict) -> dict:
+        return {'kind': kind, 'data': data}
+
+    @staticmethod
+    def _listing(children: List[dict], after: Optional[str] = None) -> dict:
+        return {'kind': 'Listing', 'data': {'after': after, 'before': None,
+                                            'dist': len(children),
+                                            'children': children}}
+
+    def _descendants(self, comments: List[dict],
+                     children: Dict[str, list]) -> List[dict]:
+        flat = []
+        stack = list(reversed(comments))
+        while stack:
+            comment = stack.pop()
+            flat.append(comment)
+            stack.extend(reversed(children.get(comment['name'], [])))
+        return flat
+
+    def _comment_tree(self, fullname: str, children: Dict[str, list],
+                      budget: List[int], depth: int = 0) -> List[dict]:
+        """
+        :param budget: single element list with the number of comments that
+                       can still be added
+        """
+        tree = []
+        siblings = children.get(fullname, [])
+        for i, comment in enumerate(siblings):
+            if budget[0] <= 0:
+                rest = siblings[i:]
+                tree.append(self._thing('more', {
+                    'id': rest[0]['id'], 'name': f't1_{rest[0]["id"]}',
+                    'parent_id': fullname, 'depth': depth,
+                    'count': len(self._descendants(rest, children)),
+                    'children': [c['id'] for c in rest]}))
+                break
+            budget[0] -= 1
+            replies = self._comment_tree(comment['name'], children, budget,
+                                         depth + 1)
+            data = dict(comment, depth=depth,
+                        replies=self._listing(replies) if replies else '')
+            tree.append(self._thing('t1', data))
+        return tree
+
+    # handlers
+
+    async def _access_token(self, request):
+        return web.json_response({'access_token': 'fake-token',
+                                  'token_type': 'bearer',
+                                  'expires_in': 86400, 'scope': '*'})
+
+    async def _about(self, request):
+        subreddit = self._subreddit(request.match_info['subreddit'])
+        return web.json_response(self._thing('t5', subreddit['about']))
+
+    async def _listing_handler(self, request):
+        subreddit = self._subreddit(request.match_info['subreddit'])
+        posts = subreddit['listings'][request.match_info['order']]
+        limit = int(request.query.get('limit', 25))
+        start = 0
+        after = request.query.get('after')
+        if after:
+            start = next((i + 1 for i, post in enumerate(posts)
+                          if post['name'] == after), len(posts))
+        page = posts[start:start + limit]
+        next_after = None
+        if page and start + limit < len(posts):
+            next_after = page[-1]['name']
+        return web.json_response(self._listing(
+            [self._thing('t3', post) for post in page], next_after))
+
+    async def _comments(self, request):
+        entry = self._posts.get(request.match_info['post_id'])
+        if entry is None:
+            raise web.HTTPNotFound()
+        post = entry['post']
+        tree = self._comment_tree(post['name'], entry['children'],
+                                  [self.max_comments_per_response])
+        return web.json_response([self._listing([self._thing('t3', post)]),
+                                  self._listing(tree)])
+
+    async def _info(self, request):
+        things = []
+        for fullname in request.query.get('id', '').split(','):
+            kind, _, item_id = fullname.partition('_')
+            if kind == 't3' and item_id in self._posts:
+                things.append(self._thing('t3', self._posts[item_id]['post']))
+            elif kind == 't1' and item_id in self._comment_index:
+                comment = self._comment_index[item_id]
+                things.append(self._thing('t1', dict(comment, replies='')))
+        return web.json_response(self._listing(things))
+
+    async def _morechildren(self, request):
+        form = await request.post()
+        requested = [self._comment_index[c]
+                     for c in form.get('children', '').split(',')
+                     if c in self._comment_index]
+        if not requested:
+            return web.json_response(
+                {'json': {'errors': [], 'data': {'things': []}}})
+        children = self._posts[requested[0]['link_id'][3:]]['children']
+        things = [self._thing('t1', dict(comment, replies=''))
+                  for comment in self._descendants(requested, children)]
+        return web.json_response(
+            {'json': {'errors': [], 'data': {'things': things}}})
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self.stats['requests'] += 1
+        if self.latency:
+            await asyncio.sleep(self._random.expovariate(1 / self.latency))
+
+        now = time.monotonic()
+        if now - self._window_start >= self.rate_limit_window:
+            self._window_start = now
+            self._used = 0
+        self._used += 1
+        headers = {
+            'x-ratelimit-used': str(self._used),
+            'x-ratelimit-remaining': str(max(0,
+                                             self.rate_limit - self._used)),
+            'x-ratelimit-reset': str(int(self.rate_limit_window
+                                         - (now - self._window_start)))
+        }
+        if self._used > self.rate_limit:
+            self.stats['throttled'] += 1
+            return web.json_response(
+                {'message': 'Too Many Requests', 'error': 429}, status=429,
+                headers=headers)
+        if self._random.random() < self.error_rate:
+            self.stats['errors'] += 1
+            return web.json_response(
+                {'message': 'Service Unavailable', 'error': 503}, status=503,
+                headers=headers)
+        response = await handler(request)
+        response.headers.update(headers)
+        return response
+
+    async def _stats(self, request):
+        return web.json_response(self.stats)
+
+    async def _add_comments_handler(self, request):
+        count = int(request.query.get('count', 1))
+        return web.json_response(self.add_comments(count))
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_post('/api/v1/access_token', self._access_token)
+        app.router.add_get('/_stats', self._stats)
+        app.router.add_post('/_add_comments', self._add_comments_handler)
+        app.router.add_post('/api/morechildren', self._morechildren)
+        app.router.add_get('/api/info', self._info)
+        app.router.add_get('/api/info/', self._info)
+        app.router.add_post('/api/morechildren/', self._morechildren)
+        for suffix in ('', '/'):
+            app.router.add_get('/r/{subreddit}/about' + suffix, self._about)
+            app.router.add_get(
+                '/r/{subreddit}/{order:' + '|'.join(ORDERS) + '}' + suffix,
+                self._listing_handler)
+            app.router.add_get('/comments/{post_id}' + suffix, self._comments)
+        return app
+
+    def run(self, host: str = '127.0.0.1', port: int = 8080):
+        web.run_app(self.app(), host=host, port=port, print=None)
+
+
+_WORDS = ('the of and to in is you that it he was for on are as with his they '
+          'at be this have from or one had by word but not what all were we '
+          'when your can said there use an each which she do how their if '
+          'will up other about out many then them these so some her would '
+          'make like him into time has look two more write go see number no '
+          'way could people my than first water been call who oil its now '
+          'find long down day did get come made may part python reddit music '
+          'data science code thread post comment').split()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='Host to listen on. "127.0.0.1" by default')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='Port to listen on. "8080" by default')
+    parser.add_argument('--posts', type=int, default=100,
+                        help='Number of posts generated per subreddit. "100" '
+                        'by default')
+    parser.add_argument('--comments', type=int, default=20,
+                        help='Average number of comments generated per post. '
+                        '"20" by default')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Average response delay in seconds. "0.05" by '
+                        'default')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with a 503. "0" '
+                        'by default')
+    parser.add_argument('--rate-limit', type=int, default=600,
+                        help='Requests allowed per rate-limit window. "600" '
+                        'by default')
+    parser.add_argument('--rate-limit-window', type=int, default=600,
+                        help='Length of the rate-limit window in seconds. '
+                        '"600" by default')
+    parser.add_argument('--fixtures', type=str, default=None,
+                        help='Folder with recorded <subreddit>.json files. '
+                        'Generated data by default')
+    parser.add_argument('--max-comments-per-response', type=int, default=200,
+                        help='Comments per comment tree response before "more '
+                        'comments" stubs are used. "200" by default')
+    args = parser.parse_args()
+    server = FakeReddit(
+        args.posts, args.comments, args.latency, args.error_rate,
+        args.rate_limit, args.rate_limit_window, args.fixtures,
+        max_comments_per_response=args.max_comments_per_response)
+    server.run(args.host, args.port)
@@ -0,0 +1,216 @@
+# request metrics for the scraper
+import bisect
+import contextvars
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional, Tuple
+
+import aiohttp
+
+# upper bounds of the latency histogram buckets in seconds, the last bucket is
+# unbounded
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# the request being measured, its HTTP traffic is attributed to it
+_current = contextvars.ContextVar('current_request', default=None)
+# stats of the last request measured in the current task, read by the retry
+# decorator
+_last = contextvars.ContextVar('last_request', default=None)
+
+
+def current_request() -> Optional[Tuple[str, str]]:
+    """
+    :return: (subreddit name, request type) of the request measured in the
+             current task, if any
+    """
+    return _current.get()
+
+
+def start_attempt():
+    """
+    Forgets the last measured request, called by the retry decorator before
+    every attempt.
+    """
+    _last.set(None)
+
+
+def record_retry(given_up: bool = False):
+    """
+    Counts a failed attempt of the last measured request as retried, or as
+    given up on.
+    """
+    stats = _last.get()
+    if stats is None:
+        return
+    if given_up:
+        stats.failures += 1
+    else:
+        stats.retries += 1
+
+
+class _RequestStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.failures = 0
+        self.http_requests = 0
+        self.bytes_received = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def to_dict(self) -> dict:
+        bucket_names = ([f'<={b}s' for b in LATENCY_BUCKETS]
+                        + [f'>{LATENCY_BUCKETS[-1]}s'])
+        mean_seconds = (round(self.total_seconds / self.requests, 4)
+                        if self.requests else None)
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'failures': self.failures,
+            'http_requests': self.http_requests,
+            'bytes_received': self.bytes_received,
+            'mean_seconds': mean_seconds,
+            'max_seconds': round(self.max_seconds, 4),
+            'latency_histogram': dict(zip(bucket_names, self.histogram))
+        }
+
+
+class ScrapeMetrics:
+    """
+    Per subreddit and request type metrics of a scrape: counts, latency
+    histograms, errors, retries, bytes received and the remaining rate-limit
+    quota.
+
+    Notes:
+        Request types are 'subreddit', 'listing', 'comments', 'replace_more'
+        and 'info'. A request is one attempt of a scraper call measured with
+        measure(), e.g. one listing. The HTTP requests and bytes it causes
+        (pages, asyncprawcore's own retries) are attributed to it through the
+        trace_config() of the session. Retries and failures are counted by
+        the retry decorator via record_retry().
+
+    Usage:
+        with metrics.measure(subreddit_name, 'comments'):
+            await post.comments()
+    """
+
+    def __init__(self):
+        self._stats = defaultdict(_RequestStats)
+        self._started = time.time()
+        self.rate_limit = {'remaining': None, 'used': None,
+                           'reset_seconds': None, 'min_remaining': None}
+
+    @contextmanager
+    def measure(self, subreddit_name: str, request_type: str):
+        """
+        Measures the latency of a request and attributes its HTTP traffic to
+        the subreddit and request type.
+        """
+        key = (subreddit_name, request_type)
+        stats = self._stats[key]
+        token = _current.set(key)
+        _last.set(stats)
+        tik = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - tik
+            _current.reset(token)
+            stats.requests += 1
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+            stats.histogram[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """
+        :return: aiohttp trace config that counts HTTP requests and received
+            bytes and keeps track of the x-ratelimit-* response headers
+        """
+        async def on_request_start(session, context, params):
+            key = _current.get()
+            if key is not None:
+                self._stats[key].http_requests += 1
+
+        async def on_response_chunk_received(session, context, params):
+            key = _current.get()
+            if key is not None:
+                self._stats[key].bytes_received += len(params.chunk)
+
+        async def on_request_end(session, context, params):
+            headers = params.response.headers
+            try:
+                remaining = float(headers['x-ratelimit-remaining'])
+                used = int(float(headers['x-ratelimit-used']))
+                reset_seconds = float(headers['x-ratelimit-reset'])
+            except (KeyError, ValueError):
+                return
+            self.rate_limit.update(remaining=remaining, used=used,
+                                   reset_seconds=reset_seconds)
+            min_remaining = self.rate_limit['min_remaining']
+            if min_remaining is None or remaining < min_remaining:
+                self.rate_limit['min_remaining'] = remaining
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_response_chunk_received.append(
+            on_response_chunk_received)
+        trace_config.on_request_end.append(on_request_end)
+        return trace_config
+
+    def to_dict(self) -> dict:
+        """
+        :return: JSON serializable metrics, per subreddit and per request type
+                 over all subreddits
+        """
+        per_subreddit = defaultdict(dict)
+        per_type = defaultdict(_RequestStats)
+        for key, stats in sorted(self._stats.items()):
+            subreddit_name, request_type = key
+            per_subreddit[subreddit_name][request_type] = stats.to_dict()
+            total = per_type[request_type]
+            for attribute in ('requests', 'errors', 'retries', 'failures',
+                              'http_requests', 'bytes_received',
+                              'total_seconds'):
+                setattr(total, attribute,
+                        getattr(total, attribute) + getattr(stats, attribute))
+            total.max_seconds = max(total.max_seconds, stats.max_seconds)
+            total.histogram = [a + b for a, b in
+                               zip(total.histogram, stats.histogram)]
+        return {
+            'timestamp': time.time(),
+            'elapsed_seconds': round(time.time() - self._started, 3),
+            'rate_limit': dict(self.rate_limit),
+            'request_types': {request_type: stats.to_dict()
+                              for request_type, stats in per_type.items()},
+            'subreddits': dict(per_subreddit)
+        }
+
+    def write_json(self, path, append: bool = False,
+                   extra: Optional[dict] = None):
+        """
+        Writes the metrics to a JSON file, or appends them as one line to a
+        JSON lines file.
+
+        :param path: the output file
+        :param append: append a single line instead of overwriting the file
+        :param extra: additional top level entries, e.g. the request queue
+                      stats
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        metrics = dict(self.to_dict(), **(extra or {}))
+        if append:
+            with open(path, 'a') as f:
+                f.write(json.dumps(metrics) + '\n')
+        else:
+            with open(path, 'w') as f:
+                json.dump(metrics, f, indent=2)
@@ -0,0 +1,185 @@
+# request scheduling and rate limiting for the scraper
+import asyncio
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Hashable, Mapping
+
+import aiohttp
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+
+    Tokens refill at `rate` per second up to `capacity`. The refill rate
+    follows the x-ratelimit-* headers returned by the reddit API, so the
+    bucket spreads the remaining quota over the rest of the rate-limit window
+    and never exceeds the configured rate.
+    """
+
+    def __init__(self, rate: float, capacity: int, quota_share: float = 1.0):
+        """
+        TokenBucket constructor
+
+        :param rate: maximum number of tokens added per second
+        :param capacity: maximum number of tokens that can be stored (burst
+            size)
+        :param quota_share: fraction of the reported remaining quota this
+            bucket may spend, for processes that share one API client
+        """
+        self.max_rate = rate
+        self.quota_share = quota_share
+        self.rate = rate
+        self.capacity = capacity
+        # remaining API quota reported by the last response
+        self.remaining = None
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+        self.waiting = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self):
+        """
+        Wait until a token is available and take it. Waiters are served in
+        FIFO order.
+        """
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self._blocked_until:
+                        await asyncio.sleep(self._blocked_until - now)
+                        continue
+                    self._refill()
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        """
+        Adjust the refill rate to the quota reported by the reddit API.
+
+        :param headers: response headers of a reddit API request
+        """
+        try:
+            remaining = float(headers['x-ratelimit-remaining'])
+            reset = float(headers['x-ratelimit-reset'])
+        except (KeyError, ValueError):
+            return
+        self._refill()
+        self.remaining = remaining
+        if remaining < 1:
+            # quota exhausted, nothing more can be sent until the window resets
+            self._tokens = 0.0
+            self._blocked_until = time.monotonic() + max(reset, 1.0)
+            return
+        self.rate = min(self.max_rate,
+                        self.quota_share * remaining / max(reset, 1.0))
+
+
+class RequestScheduler:
+    """
+    Caps the number of in-flight requests per session and globally, and paces
+    them with a shared token bucket.
+
+    Notes:
+        The concurrency caps apply to the calls wrapped in slot(). The token
+        bucket applies to every HTTP request sent through a session created
+        with trace_config(), including listing pages and authentication.
+
+    Usage:
+        async with scheduler.slot(session):
+            await post.comments()
+    """
+
+    def __init__(self, max_in_flight: int, max_in_flight_per_session: int,
+                 rate: float, burst: int, quota_share: float = 1.0):
+        """
+        RequestScheduler constructor
+
+        :param max_in_flight: maximum number of concurrent requests across all
+            sessions
+        :param max_in_flight_per_session: maximum number of concurrent
+            requests per session
+        :param rate: maximum number of requests started per second
+        :param burst: number of requests that can be started at once after an
+            idle period
+        :param quota_share: fraction of the API quota reported in the
+            rate-limit headers that may be used
+        """
+        self.bucket = TokenBucket(rate, burst, quota_share)
+        self._global = asyncio.Semaphore(max_in_flight)
+        self._sessions = defaultdict(
+            lambda: asyncio.Semaphore(max_in_flight_per_session))
+        self.queued = 0
+        self.in_flight = 0
+        self.max_queued = 0
+        self.completed = 0
+
+    @asynccontextmanager
+    async def slot(self, session: Hashable = None):
+        """
+        Waits for a free request slot.
+
+        :param session: key of the session that sends the request
+        """
+        self.queued += 1
+        self.max_queued = max(self.max_queued, self.queued)
+        waiting = True
+        try:
+            async with self._sessions[session], self._global:
+                self.queued -= 1
+                waiting = False
+                self.in_flight += 1
+                try:
+                    yield
+                finally:
+                    self.in_flight -= 1
+                    self.completed += 1
+        finally:
+            # cancelled while waiting for a slot
+            if waiting:
+                self.queued -= 1
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """
+        :return: aiohttp trace config that takes a token before each request
+            is sent and feeds the response rate-limit headers back to the
+            token bucket
+        """
+        async def on_request_start(session, context, params):
+            await self.bucket.acquire()
+
+        async def on_request_end(session, context, params):
+            self.bucket.update_from_headers(params.response.headers)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        return trace_config
+
+    def stats(self) -> dict:
+        """
+        :return: queue depth, in-flight requests and current refill rate
+        """
+        return {
+            'queued': self.queued,
+            'waiting_for_token': self.bucket.waiting,
+            'max_queued': self.max_queued,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'rate': round(self.bucket.rate, 3),
+            'remaining_quota': self.bucket.remaining
+        }
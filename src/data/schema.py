@@ -0,0 +1,66 @@
+# columns of the files written by the scraper
+from typing import List
+
+SUBREDDIT_COLUMNS = ['name', 'description', 'subscribers', 'subreddit']
+
+POST_COLUMNS = ['post_id', 'title', 'flair', 'score', 'post_upvote_ratio',
+                'url', 'num_comments', 'body', 'created', 'subreddit',
+                'listings']
+
+COMMENT_COLUMNS = ['post_id', 'comment_id', 'parent_id',
+                   'comment', 'up_vote_count', 'controversiality',
+                   'total_awards_received', 'is_locked', 'is_collapsed',
+                   'is_submitter', 'created_utc', 'subreddit']
+
+# columns updated by a metric refresh, mapped to the reddit attribute they
+# are read from
+POST_METRICS = {'score': 'score',
+                'post_upvote_ratio': 'upvote_ratio',
+                'num_comments': 'num_comments'}
+
+COMMENT_METRICS = {'up_vote_count': 'ups',
+                   'controversiality': 'controversiality',
+                   'total_awards_received': 'total_awards_received',
+                   'is_locked': 'locked',
+                   'is_collapsed': 'collapsed'}
+
+
+def subreddit_row(subreddit, subreddit_name: str) -> list:
+    return [subreddit.display_name,
+            subreddit.public_description,
+            subreddit.subscribers,
+            subreddit_name]
+
+
+def post_row(post, subreddit_name: str, listings: List[str]) -> list:
+    """
+    :param listings: the scrape orders whose listings contained the post
+    """
+    return [post.id,
+            post.title,
+            post.link_flair_text,
+            post.score,
+            post.upvote_ratio,
+            # post.subreddit,
+            post.url,
+            post.num_comments,
+            post.selftext,
+            post.created,
+            subreddit_name,
+            '|'.join(listings)]
+
+
+def comment_row(comment, subreddit_name: str) -> list:
+    return [comment.submission.id,
+            comment.id,
+            comment.parent_id,
+            # comment.author.id,
+            comment.body,
+            comment.ups,
+            comment.controversiality,
+            comment.total_awards_received,
+            comment.locked,
+            comment.collapsed,
+            comment.is_submitter,
+            comment.created_utc,
+            subreddit_name]
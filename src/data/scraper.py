@@ -3,15 +3,29 @@ import argparse
 import time
 import logging
 import asyncio
+import functools
+import inspect
+import random
+import aiohttp
 import asyncpraw
+from asyncpraw.models import MoreComments
 import pandas as pd
 import numpy as np
+from collections import Counter, deque
 from dataclasses import dataclass, field
 from typing import List
 
 from src.utils import get_project_root
 from contextlib import asynccontextmanager
 from config import ScraperConfig, default_config
+from archive import PayloadArchive, read_segments, rebuild_rows
+from checkpoint import CheckpointStore
+from metrics import ScrapeMetrics, record_retry, start_attempt
+from ratelimit import RequestScheduler
+from schema import (SUBREDDIT_COLUMNS, POST_COLUMNS, COMMENT_COLUMNS,
+                    POST_METRICS, COMMENT_METRICS, subreddit_row, post_row,
+                    comment_row)
+from sink import CsvSink
 
 # reddit API credentials
 CLIENT_ID = 'xG2uYfBViT_APANuInp5Yw'
@@ -29,18 +43,33 @@ class TerminalError(Exception):
     pass
 
 
-def async_retry(times=3, delay=0):
+def async_retry(times=3, delay=1, max_delay=30):
     """
-    async retry decorator
+    async retry decorator with exponential backoff and full jitter.
+    Waits with asyncio.sleep, so other requests keep running in the meantime.
+
+    :param times: total number of attempts
+    :param delay: base delay in seconds, doubled after every failed attempt
+    :param max_delay: upper bound of the delay in seconds
+    :raises TerminalError: when all attempts failed, chained to the last error
     """
     def func_wrapper(fn):
+        @functools.wraps(fn)
         async def wrapper(*args, **kwargs):
-            for _ in range(times):
+            error = None
+            for attempt in range(times):
+                start_attempt()
                 try:
                     return await fn(*args, **kwargs)
-                except Exception:
-                    time.sleep(delay)
-            raise TerminalError()
+                except Exception as e:
+                    error = e
+                    if attempt < times - 1:
+                        record_retry()
+                        backoff = min(max_delay, delay * 2 ** attempt)
+                        await asyncio.sleep(random.uniform(0, backoff))
+            record_retry(given_up=True)
+            raise TerminalError(f'{fn.__name__} failed after {times} '
+                                f'attempts: {error!r}') from error
         return wrapper
     return func_wrapper
 
@@ -49,118 +78,401 @@ def async_retry(times=3, delay=0):
 class SubRedditData:
     name: str
     subreddit_df: pd.DataFrame = field(repr=False)
-    posts_df: pd.DataFrame = field(repr=False)
-    comments_df: pd.DataFrame = field(repr=False)
+    post_count: int
+    comment_count: int
 
 
 class AsyncRedditScraper:
     def __init__(self, config: ScraperConfig):
         self.config = config
         self._data: List[SubRedditData] = []
+        self._store = None
+        self._run_id = None
+        self._scheduler = None
+        self._archive = None
+        self.failures: List[dict] = []
+        self.metrics = ScrapeMetrics()
+
+    def _generate_session(self):
+        """
+        Creates a reddit session whose connections are kept alive and reused
+        across requests.
+        """
+        connector = aiohttp.TCPConnector(
+            limit=self.config.max_in_flight_per_session,
+            keepalive_timeout=self.config.keepalive_timeout)
+        # every request of the session is paced by the scheduler's token
+        # bucket and measured
+        trace_configs = [self._scheduler.trace_config(),
+                         self.metrics.trace_config()]
+        http_session = aiohttp.ClientSession(connector=connector,
+                                             trace_configs=trace_configs)
+        urls = {}
+        if self.config.api_url:
+            urls = {'oauth_url': self.config.api_url,
+                    'reddit_url': self.config.api_url}
+        session = asyncpraw.Reddit(client_id=CLIENT_ID,
+                                   client_secret=CLIENT_SECRET,
+                                   user_agent=USER_AGENT,
+                                   requestor_kwargs={'session': http_session},
+                                   **urls)
+        if self._archive is not None:
+            session.request = self._archive.wrap(session.request)
+        return session
 
     @asynccontextmanager
-    async def _generate_session(self):
-        session =  asyncpraw.Reddit(client_id=CLIENT_ID,
-                                    client_secret=CLIENT_SECRET,
-                                    user_agent=CLIENT_SECRET)
+    async def _session_pool(self):
+        """
+        Long-lived pool of reddit sessions shared by all subreddits of a
+        scrape, so that authentication and connection setup happen once per
+        session instead of once per subreddit.
+        """
+        sessions = [self._generate_session()
+                    for _ in range(max(1, self.config.session_pool_size))]
         try:
-            yield session
-        except Exception:
-            pass
+            yield sessions
         finally:
-            await session.close()
+            await asyncio.gather(*(session.close() for session in sessions))
 
-    async def _fetch_from_single_subreddit(self, subreddit_name: str):
+    async def _fetch_from_single_subreddit(self, session, subreddit_name: str):
         logger.info(f'start scraping subreddit: {subreddit_name}')
-        async with self._generate_session() as session:
-            posts_retrieved = []
-            comments_retrieved = []
-            subreddit_retrieved = []
-
-            subreddit = await session.subreddit(subreddit_name, fetch=True)
-
+        subreddit_retrieved = []
+        processed_posts = []
+        processed_comments = []
+        failed = False
+        append = self._store is not None
+        posts_sink = CsvSink(self._output_path(subreddit_name, 'posts'),
+                             POST_COLUMNS, append=append,
+                             buffer_rows=self.config.flush_rows)
+        comments_sink = CsvSink(self._output_path(subreddit_name, 'comments'),
+                                COMMENT_COLUMNS, append=append,
+                                buffer_rows=self.config.flush_rows)
+        with posts_sink, comments_sink:
             try:
-                subreddit_retrieved.append([
-                    subreddit.display_name,
-                    subreddit.public_description,
-                    subreddit.subscribers
-                ])
-            except Exception as e:
-                print(e)
-
-            scrape_order = {
-                'hot': subreddit.hot,
-                'new': subreddit.new,
-                'top': subreddit.top,
-                'rising': subreddit.rising
-            }
-
-            posts = [post async for post in
-                     scrape_order[self.config.scrape_order](limit=self.config.max_post_count)
-                     if not post.stickied]
+                subreddit = await self._fetch_subreddit(session,
+                                                        subreddit_name)
 
-            comment_forests = await asyncio.gather(*[post.comments() for post in posts])
-            await asyncio.gather(*[comment_forest.replace_more(0) for comment_forest in comment_forests])
-
-            comment_count = 0
-            iteration_count = 0
-            try:
-                for comment_forest in comment_forests:
-                    top_comments = comment_forest.list()[:self.config.max_comment_per_post][::-1]
+                try:
+                    subreddit_retrieved.append(
+                        subreddit_row(subreddit, subreddit_name))
+                except Exception as e:
+                    logger.error(f'failed to read subreddit {subreddit_name}: '
+                                 f'{e}')
+
+                posts, listings = await self._fetch_posts(subreddit_name,
+                                                          subreddit)
+
+                # incremental mode: skip posts whose comment count has not
+                # changed since the last scrape
+                seen_posts = {}
+                seen_comments = set()
+                if self._store is not None:
+                    seen_posts = self._store.seen_posts(subreddit_name)
+                    posts = [post for post in posts
+                             if seen_posts.get(post.id) != post.num_comments]
+                    seen_comments = self._store.seen_comments(
+                        subreddit_name,
+                        [post.id for post in posts if post.id in seen_posts])
+                    logger.info(f'{subreddit_name}: {len(posts)} new or '
+                                f'changed posts since the last scrape')
+
+                # the comment budget is spent on the most commented posts
+                # first
+                posts = sorted(posts, key=lambda post: post.num_comments,
+                               reverse=True)
+
+                comment_count = 0
+                async for post, comments in self._iter_comments(
+                        session, subreddit_name, posts):
+                    # comments written by earlier scrapes are dropped before
+                    # the per-post limit, so the limit is spent on the new
+                    # comments of a changed post
+                    new_comments = [comment for comment in comments
+                                    if not comment.stickied
+                                    and comment.id not in seen_comments]
+                    top_comments = new_comments[
+                        :self.config.max_comment_per_post]
                     comment_count += len(top_comments)
-                    iteration_count += 1
-                    while top_comments:
-                        comment = top_comments.pop()
-                        if comment.stickied:
-                            continue
-                        comments_retrieved.append([comment.submission.id,
-                                                   comment.id,
-                                                   comment.parent_id,
-                                                   # comment.author.id,
-                                                   comment.body,
-                                                   comment.ups,
-                                                   comment.controversiality,
-                                                   comment.total_awards_received,
-                                                   comment.locked,
-                                                   comment.collapsed,
-                                                   comment.is_submitter,
-                                                   comment.created_utc])
+                    for comment in top_comments:
+                        comments_sink.write(comment_row(comment,
+                                                        subreddit_name))
+                        processed_comments.append((comment.id, post.id))
+                    # existing posts only get their new comments appended
+                    if post.id not in seen_posts:
+                        posts_sink.write(post_row(post, subreddit_name,
+                                                  listings[post.id]))
+                    processed_posts.append((post.id, post.num_comments))
                     if comment_count > self.config.max_comment_count:
                         break
             except Exception as e:
-                print(e)
+                logger.error(f'failed to scrape subreddit {subreddit_name}: '
+                             f'{e}')
+                self._record_failure(subreddit_name, 'subreddit',
+                                     subreddit_name, e)
+                failed = True
+
+        subreddit_df = pd.DataFrame(subreddit_retrieved,
+                                    columns=SUBREDDIT_COLUMNS)
+        subreddit_df.to_csv(self._output_path(subreddit_name, 'subreddit'),
+                            index=False)
+
+        if self._store is not None:
+            # the files are committed before the ids are recorded, so a crash
+            # can only cause a re-fetch and never a gap
+            self._store.record(subreddit_name, processed_posts,
+                               processed_comments)
+            if not failed:
+                self._store.finish_subreddit(self._run_id, subreddit_name)
+        return SubRedditData(subreddit_name, subreddit_df,
+                             len(processed_posts), len(processed_comments))
+
+    async def _iter_comments(self, session, subreddit_name: str, posts):
+        """
+        Yields (post, flattened comments) pairs in the order of the posts.
+        Only a small window of comment requests runs ahead of the consumer, so
+        completed forests do not pile up in memory and no further requests
+        are sent once the consumer stops.
+
+        Requests are only issued while the comments expected from the posts
+        in flight (their num_comments, capped at max_comment_per_post) fit
+        into the max_comment_count budget.
+
+        Posts whose comments could not be fetched after retrying are recorded
+        as failures and skipped.
+        """
+        window = deque()
+        remaining = iter(posts)
+        window_size = 2 * self.config.max_in_flight_per_session
+        reserved = 0
+
+        def expected(post):
+            return min(post.num_comments, self.config.max_comment_per_post)
+
+        def fill():
+            nonlocal reserved
+            while (len(window) < window_size
+                   and reserved <= self.config.max_comment_count):
+                post = next(remaining, None)
+                if post is None:
+                    return
+                reserved += expected(post)
+                task = asyncio.ensure_future(
+                    self._fetch_post_comments(session, subreddit_name, post))
+                window.append((post, task))
+
+        try:
+            fill()
+            while window:
+                post, task = window.popleft()
+                try:
+                    comments = await task
+                except TerminalError as e:
+                    self._record_failure(subreddit_name, 'comments', post.id,
+                                         e)
+                    reserved -= expected(post)
+                    fill()
+                    continue
+                reserved += (min(len(comments),
+                                 self.config.max_comment_per_post)
+                             - expected(post))
+                fill()
+                yield post, comments
+        finally:
+            for _, task in window:
+                task.cancel()
+
+    @async_retry(times=4, delay=1)
+    async def _fetch_subreddit(self, session, subreddit_name: str):
+        with self.metrics.measure(subreddit_name, 'subreddit'):
+            return await session.subreddit(subreddit_name, fetch=True)
+
+    @async_retry(times=4, delay=1)
+    async def _fetch_listing(self, subreddit_name: str, subreddit,
+                             order: str):
+        """
+        Fetches the non-stickied posts of the subreddit in the given scrape
+        order.
+        """
+        scrape_order = {
+            'hot': subreddit.hot,
+            'new': subreddit.new,
+            'top': subreddit.top,
+            'rising': subreddit.rising
+        }
 
+        with self.metrics.measure(subreddit_name, 'listing'):
+            return [post async for post in
+                    scrape_order[order](limit=self.config.max_post_count)
+                    if not post.stickied]
+
+    async def _fetch_posts(self, subreddit_name: str, subreddit):
+        """
+        Fetches the listings of all configured scrape orders and merges them,
+        so that posts appearing in several listings have their comments
+        fetched only once.
+
+        :return: the unique posts in order of first appearance, and a mapping
+            of post id to the orders whose listings contained the post
+        """
+        posts = {}
+        listings = {}
+        for order in self.config.scrape_orders:
+            for post in await self._fetch_listing(subreddit_name, subreddit,
+                                                  order):
+                posts.setdefault(post.id, post)
+                listings.setdefault(post.id, []).append(order)
+        return list(posts.values()), listings
+
+    @async_retry(times=4, delay=1)
+    async def _fetch_comments(self, session, subreddit_name: str, post):
+        """
+        Fetches the comment forest of a post, waiting for a free request slot
+        of the session.
+
+        :return: the flattened list of comments
+        """
+        async with self._scheduler.slot(session):
+            with self.metrics.measure(subreddit_name, 'comments'):
+                if callable(post.comments):
+                    # asyncpraw < 7.5 fetches the forest when it is called
+                    comment_forest = await post.comments()
+                else:
+                    await post.load()
+                    comment_forest = post.comments
+        if self.config.expand_more_depth <= 0:
+            # limit 0 only removes the "more comments" stubs and sends no
+            # requests
+            await comment_forest.replace_more(0)
+        comments = comment_forest.list()
+        if inspect.isawaitable(comments):
+            comments = await comments
+        return comments
+
+    @async_retry(times=4, delay=1)
+    async def _fetch_more(self, session, subreddit_name: str,
+                          more: MoreComments):
+        async with self._scheduler.slot(session):
+            with self.metrics.measure(subreddit_name, 'replace_more'):
+                return await more.comments()
+
+    async def _expand_comments(self, session, subreddit_name: str, post,
+                               comments):
+        """
+        Replaces "more comments" stubs breadth-first, shallowest first, until
+        the post has max_comment_per_post comments. Stubs deeper than
+        expand_more_depth are dropped.
+
+        :param comments: flattened comments of the post, including "more
+            comments" stubs
+        :return: the flattened comments without stubs
+        """
+        stubs = [c for c in comments if isinstance(c, MoreComments)]
+        queue = deque(sorted(stubs,
+                             key=lambda more: getattr(more, 'depth', 0) or 0))
+        comments = [c for c in comments if not isinstance(c, MoreComments)]
+        while queue and len(comments) < self.config.max_comment_per_post:
+            more = queue.popleft()
+            depth = getattr(more, 'depth', 0) or 0
+            if depth >= self.config.expand_more_depth:
+                continue
+            if more.submission is None:
+                more.submission = post
             try:
-                for post in posts[:iteration_count]:
-                    posts_retrieved.append([post.id,
-                                            post.title,
-                                            post.link_flair_text,
-                                            post.score,
-                                            post.upvote_ratio,
-                                            # post.subreddit,
-                                            post.url,
-                                            post.num_comments,
-                                            post.selftext,
-                                            post.created])
-            except Exception as e:
-                print(e)
-
-        subreddit_df = pd.DataFrame(subreddit_retrieved, columns=['name', 'description', 'subscribers'])
-        subreddit_df['subreddit'] = subreddit_name
-        posts_df = pd.DataFrame(posts_retrieved,
-                                columns=['post_id', 'title', 'flair', 'score', 'post_upvote_ratio',
-                                         'url', 'num_comments', 'body', 'created'])
-        posts_df['subreddit'] = subreddit_name
-        comments_df = pd.DataFrame(comments_retrieved,
-                                   columns=['post_id', 'comment_id', 'parent_id',
-                                            'comment', 'up_vote_count', 'controversiality',
-                                            'total_awards_received', 'is_locked', 'is_collapsed',
-                                            'is_submitter', 'created_utc'])
-        comments_df['subreddit'] = subreddit_name
-        return SubRedditData(subreddit_name, subreddit_df, posts_df, comments_df)
-
-    @async_retry(times=3, delay=10)
-    async def scrape(self):
+                children = await self._fetch_more(session, subreddit_name,
+                                                  more)
+            except TerminalError as e:
+                self._record_failure(subreddit_name, 'replace_more', post.id,
+                                     e)
+                continue
+            for child in children:
+                if isinstance(child, MoreComments):
+                    queue.append(child)
+                else:
+                    comments.append(child)
+        return comments
+
+    async def _fetch_post_comments(self, session, subreddit_name: str, post):
+        comments = await self._fetch_comments(session, subreddit_name, post)
+        if self.config.expand_more_depth > 0:
+            comments = await self._expand_comments(session, subreddit_name,
+                                                   post, comments)
+        return comments
+
+    def _record_failure(self, subreddit_name: str, stage: str, item: str,
+                        error: Exception):
+        self.failures.append({
+            'subreddit': subreddit_name,
+            'stage': stage,
+            'item': item,
+            'error': str(error.__cause__ or error)
+        })
+
+    def failure_summary(self) -> pd.DataFrame:
+        """
+        :return: number of failed requests per subreddit and stage
+            ('subreddit', 'comments', 'replace_more' or 'info')
+        """
+        counts = Counter((failure['subreddit'], failure['stage'])
+                         for failure in self.failures)
+        return pd.DataFrame([[name, stage, count]
+                             for (name, stage), count in counts.items()],
+                            columns=['subreddit', 'stage', 'failures'])
+
+    async def _report_queue(self, run_type: str):
+        while True:
+            await asyncio.sleep(self.config.metrics_interval)
+            logger.info(f'request queue: {self._scheduler.stats()}')
+            if self.config.stream_metrics:
+                self.metrics.write_json(
+                    self._metrics_path(run_type, 'jsonl'), append=True,
+                    extra={'request_queue': self._scheduler.stats()})
+
+    async def _run_on_sessions(self, fetch, subreddit_list: List[str],
+                               run_type: str) -> list:
+        """
+        Runs fetch(session, subreddit_name) for every subreddit concurrently
+        on the shared session pool. The request metrics of the run are
+        written to results/{run_type}_{order}_metrics.json at the end.
+
+        :param run_type: 'scrape' or 'refresh'
+        :return: the results of fetch in the order of subreddit_list
+        """
+        self.metrics = ScrapeMetrics()
+        if self.config.archive:
+            self._archive = PayloadArchive(self._archive_path(),
+                                           self.config.order_tag)
+        self._scheduler = RequestScheduler(
+            self.config.max_in_flight, self.config.max_in_flight_per_session,
+            self.config.requests_per_second, self.config.request_burst,
+            self.config.quota_share)
+        reporter = asyncio.create_task(self._report_queue(run_type))
+        try:
+            async with self._session_pool() as sessions:
+                return await asyncio.gather(
+                    *(fetch(sessions[i % len(sessions)], subreddit_name)
+                      for i, subreddit_name in enumerate(subreddit_list)))
+        finally:
+            reporter.cancel()
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+            logger.info(f'request queue: {self._scheduler.stats()}')
+            metrics_path = self._metrics_path(run_type, 'json')
+            self.metrics.write_json(
+                metrics_path,
+                extra={'request_queue': self._scheduler.stats()})
+            logger.info(f'request metrics written to {metrics_path}')
+            if self.failures:
+                summary = self.failure_summary().to_string(index=False)
+                logger.warning(f'{len(self.failures)} requests failed after '
+                               f'retrying:\n{summary}')
+
+    async def scrape(self, finish_run: bool = True):
+        """
+        :param finish_run: mark the incremental run as finished at the end.
+            The workers of a sharded scrape leave that to the parent process,
+            which waits for all of them.
+        """
 
         scrape_order_str = {
             'hot': 'hottest',
@@ -169,45 +481,192 @@ class AsyncRedditScraper:
             'rising': 'rising'
         }
 
-        logger.info(f'start scraping top {self.config.max_post_count} {scrape_order_str[self.config.scrape_order]} posts with '
+        order_str = ', '.join(scrape_order_str[order]
+                              for order in self.config.scrape_orders)
+        logger.info(f'start scraping top {self.config.max_post_count} '
+                    f'{order_str} posts with '
                     f'{self.config.max_comment_per_post} comments per post and {self.config.max_comment_count} total comments from the following subreddits: '
                     f'{", ".join(self.config.subreddit_list)}')
+        subreddit_list = self.config.subreddit_list
+        checkpoint_path = get_project_root().joinpath(
+            self.config.checkpoint_path)
+        if self.config.incremental:
+            self._store = CheckpointStore(checkpoint_path)
+            self._run_id, finished = self._store.start_run(
+                self.config.order_tag)
+            if finished:
+                logger.info(f'resuming unfinished run, skipping: '
+                            f'{", ".join(sorted(finished))}')
+            subreddit_list = [name for name in subreddit_list
+                              if name not in finished]
         try:
-            self._data = await asyncio.gather(*(self._fetch_from_single_subreddit(subreddit_name) for
-                                              subreddit_name in self.config.subreddit_list))
-        except Exception:
-            logger.error("failed to scrape, retrying...")
-            raise
+            self._data = await self._run_on_sessions(
+                self._fetch_from_single_subreddit, subreddit_list, 'scrape')
+        finally:
+            if self._store is not None:
+                self._store.close()
+                self._store = None
+        if self.config.incremental and finish_run:
+            with CheckpointStore(checkpoint_path) as store:
+                store.finish_run(self._run_id)
         return self
 
-    def save_to_file(self):
-        if not self._data:
-            pass
+    @async_retry(times=4, delay=1)
+    async def _fetch_info(self, session, subreddit_name: str,
+                          fullnames: List[str]) -> list:
+        """
+        Looks up at most 100 posts or comments by fullname in a single
+        request.
+        """
+        async with self._scheduler.slot(session):
+            with self.metrics.measure(subreddit_name, 'info'):
+                return [thing async for thing
+                        in session.info(fullnames=fullnames)]
+
+    async def _refresh_single_subreddit(self, session, subreddit_name: str):
+        refreshed = {}
+        for kind, prefix, id_column, metrics in (
+                ('posts', 't3_', 'post_id', POST_METRICS),
+                ('comments', 't1_', 'comment_id', COMMENT_METRICS)):
+            path = self._output_path(subreddit_name, kind)
+            refreshed[kind] = 0
+            if not path.exists():
+                logger.warning(f'nothing to refresh, {path} does not exist')
+                continue
+            sink = None
+            for chunk in pd.read_csv(path, chunksize=self.config.flush_rows,
+                                     dtype={'post_id': str, 'comment_id': str,
+                                            'parent_id': str}):
+                if sink is None:
+                    sink = CsvSink(path, list(chunk.columns))
+                fullnames = (prefix + chunk[id_column]).tolist()
+                batches = [fullnames[i:i + 100]
+                           for i in range(0, len(fullnames), 100)]
+                results = await asyncio.gather(
+                    *(self._fetch_info(session, subreddit_name, batch)
+                      for batch in batches),
+                    return_exceptions=True)
+                found = {}
+                for batch, result in zip(batches, results):
+                    if isinstance(result, TerminalError):
+                        self._record_failure(subreddit_name, 'info', batch[0],
+                                             result)
+                    elif isinstance(result, BaseException):
+                        raise result
+                    else:
+                        found.update((thing.id, thing) for thing in result)
+                # items that were not returned (e.g. deleted) keep their
+                # previous values
+                mask = chunk[id_column].isin(found)
+                for column, attribute in metrics.items():
+                    chunk[column] = chunk[column].astype(object)
+                    chunk.loc[mask, column] = [
+                        getattr(found[item_id], attribute)
+                        for item_id in chunk.loc[mask, id_column]]
+                refreshed[kind] += int(mask.sum())
+                sink.write_frame(chunk)
+            if sink is not None:
+                sink.commit()
+        logger.info(f'Subreddit {subreddit_name} refreshed '
+                    f'{refreshed["posts"]} posts and '
+                    f'{refreshed["comments"]} comments.')
+        return refreshed
+
+    async def refresh(self):
+        """
+        Refreshes the metrics (see POST_METRICS and COMMENT_METRICS in
+        schema.py) of previously scraped posts and comments in place. Items
+        are looked up by fullname through reddit's info endpoint, 100 per
+        request, instead of re-walking the listings and comment forests.
+        """
+        logger.info(f'start refreshing posts and comments of the following '
+                    f'subreddits: {", ".join(self.config.subreddit_list)}')
+        await self._run_on_sessions(self._refresh_single_subreddit,
+                                    self.config.subreddit_list, 'refresh')
+        return self
 
-        p = get_project_root()
-        t1 = get_project_root().joinpath('data/results')
-        t1.mkdir(parents=True, exist_ok=True)
-        t2 = get_project_root().joinpath('data/raw')
-        t2.mkdir(parents=True, exist_ok=True)
+    def rebuild(self):
+        """
+        Regenerates the data/raw posts and comments files and the subreddit
+        summaries of the configured subreddits and order from the archived
+        API responses, without any requests. See rebuild_rows() in archive.py.
+        """
+        self._data = []
+        for subreddit_name in self.config.subreddit_list:
+            subreddit_rows, post_rows, comment_rows = rebuild_rows(
+                read_segments(self._archive_path(), subreddit_name,
+                              self.config.order_tag),
+                subreddit_name, self.config.max_comment_per_post)
+            if not subreddit_rows and not post_rows:
+                logger.warning(f'nothing to rebuild, no archive of '
+                               f'{subreddit_name} for {self.config.order_tag}')
+                continue
+            with CsvSink(self._output_path(subreddit_name, 'posts'),
+                         POST_COLUMNS,
+                         buffer_rows=self.config.flush_rows) as posts_sink:
+                posts_sink.write_many(post_rows)
+            with CsvSink(self._output_path(subreddit_name, 'comments'),
+                         COMMENT_COLUMNS,
+                         buffer_rows=self.config.flush_rows) as comments_sink:
+                comments_sink.write_many(comment_rows)
+            subreddit_df = pd.DataFrame(subreddit_rows,
+                                        columns=SUBREDDIT_COLUMNS)
+            self._data.append(SubRedditData(subreddit_name, subreddit_df,
+                                            len(post_rows), len(comment_rows)))
+            logger.info(f'Subreddit {subreddit_name} rebuilt '
+                        f'{len(post_rows)} posts and {len(comment_rows)} '
+                        f'comments from the archive.')
+        return self.save_to_file()
+
+    def _archive_path(self):
+        return get_project_root().joinpath(self.config.data_dir, 'archive')
+
+    def _output_path(self, subreddit_name: str, kind: str):
+        """
+        :param kind: 'subreddit', 'posts' or 'comments'
+        :return: path of the file the scraper writes for the subreddit
+        """
+        folder = 'results' if kind == 'subreddit' else 'raw'
+        p = get_project_root().joinpath(self.config.data_dir, folder)
+        p.mkdir(parents=True, exist_ok=True)
+        return p.joinpath(
+            f'{subreddit_name}_{self.config.order_tag}_{kind}.csv')
+
+    def _metrics_path(self, run_type: str, extension: str):
+        p = get_project_root().joinpath(self.config.data_dir, 'results')
+        shard = f'_{self.config.shard}' if self.config.shard else ''
+        return p.joinpath(
+            f'{run_type}_{self.config.order_tag}{shard}_metrics.{extension}')
 
+    def save_to_file(self):
+        """
+        Posts and comments are streamed to file while scraping, this only
+        rewrites the subreddit summaries.
+        """
         for data_obj in self._data:
-            data_obj.subreddit_df.to_csv(p.joinpath(f'data/results/{data_obj.name}_{self.config.scrape_order}_subreddit.csv'), index=False)
-            data_obj.posts_df.to_csv(p.joinpath(f'data/raw/{data_obj.name}_{self.config.scrape_order}_posts.csv'), index=False)
-            data_obj.comments_df.to_csv(p.joinpath(f'data/raw/{data_obj.name}_{self.config.scrape_order}_comments.csv'), index=False)
+            data_obj.subreddit_df.to_csv(
+                self._output_path(data_obj.name, 'subreddit'), index=False)
         return self
 
 
-async def main(argparse_config, default):
+async def main(argparse_config, default, refresh=False, rebuild=False):
     if default:
         scraper = AsyncRedditScraper(default_config)
     else:
         scraper = AsyncRedditScraper(argparse_config)
+    if rebuild:
+        scraper.rebuild()
+        return
+    if refresh:
+        await scraper.refresh()
+        return
     scraped = await scraper.scrape()
-    logger.info("All Success!")
+    if not scraped.failures:
+        logger.info("All Success!")
     for data_obj in scraped._data:
         logger.info(f"Subreddit {data_obj.name} retrieved "
-                    f"{data_obj.posts_df.shape[0]} posts and "
-                    f"{data_obj.comments_df.shape[0]} comments.")
+                    f"{data_obj.post_count} posts and "
+                    f"{data_obj.comment_count} comments.")
     scraped.save_to_file()
 
 
@@ -221,9 +680,10 @@ if __name__ == '__main__':
             help='Subreddit to scrape data from. "computerscience" by default')
 
     # Scrape order argument
-    parser.add_argument('-o', '--order', type=str, 
-            default="hot",
-            help='The order to scrape the data by. "hot" by default')
+    parser.add_argument('-o', '--order', type=str, nargs='+',
+            default=["hot"],
+            help='The order(s) to scrape the data by. Posts found in several '
+            'orders are scraped once. "hot" by default')
 
     # Maximum number of posts to scrape
     parser.add_argument('-mp', '--maxpost', type=int, 
@@ -240,6 +700,47 @@ if __name__ == '__main__':
             default=10000,
             help='The maximum number comments scraped. "10000" by default')
 
+    # Depth down to which "more comments" stubs are expanded
+    parser.add_argument('-em', '--expandmore', type=int,
+            default=0,
+            help='Expand "more comments" stubs breadth-first above this '
+            'comment depth, 1 expands only top level stubs. "0" (no '
+            'expansion) by default')
+
+    # Flag indicator for incremental scraping
+    parser.add_argument('-i', '--incremental', default=False,
+                        action='store_true',
+                        help='Only scrape posts and comments that are new '
+                        'since the last scrape and append them to the '
+                        'existing files. Interrupted runs are resumed. '
+                        '"False" by default.')
+
+    # Flag indicator for refreshing the metrics of scraped posts and comments
+    parser.add_argument('-r', '--refresh', default=False, action='store_true',
+                        help='Refresh scores, upvotes and controversiality of '
+                        'the posts and comments already in data/raw instead '
+                        'of scraping. "False" by default.')
+
+    # Flag indicator for archiving the raw API responses
+    parser.add_argument('-a', '--archive', default=False, action='store_true',
+                        help='Also write the raw API responses to compressed '
+                        'segments in data/archive, so the tables can be '
+                        'rebuilt later without scraping again. "False" by '
+                        'default.')
+
+    # Flag indicator for rebuilding the tables from the archive
+    parser.add_argument('-rb', '--rebuild', default=False, action='store_true',
+                        help='Regenerate the posts and comments files in '
+                        'data/raw from data/archive instead of scraping. '
+                        '"False" by default.')
+
+    # Flag indicator for streaming request metrics during the run
+    parser.add_argument('-sm', '--streammetrics', default=False,
+                        action='store_true',
+                        help='Append a snapshot of the request metrics to '
+                        'data/results/*_metrics.jsonl every 30 seconds while '
+                        'scraping. "False" by default.')
+
     # Flag indicator for to use default config for scraper.
     parser.add_argument('-d',
                         '--default',
@@ -251,13 +752,18 @@ if __name__ == '__main__':
     args = parser.parse_args()
     argparse_config = ScraperConfig(
         subreddit_list=[args.subreddit],
-        scrape_order=args.order,
+        scrape_order=args.order[0] if len(args.order) == 1 else args.order,
         max_post_count=args.maxpost,
         max_comment_per_post=args.maxcommentpost,
-        max_comment_count=args.maxcomment
+        max_comment_count=args.maxcomment,
+        expand_more_depth=args.expandmore,
+        incremental=args.incremental,
+        archive=args.archive,
+        stream_metrics=args.streammetrics
     )
 
     tik = time.perf_counter()
-    asyncio.run(main(argparse_config, args.default))
+    asyncio.run(main(argparse_config, args.default, args.refresh,
+                     args.rebuild))
     tok = time.perf_counter()
     logger.info(f"total run time {tok-tik}")
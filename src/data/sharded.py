@@ -0,0 +1,185 @@
+# multi-process scraping of a subreddit list split into shards
+import sys
+import argparse
+import asyncio
+import dataclasses
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+from src.utils import get_project_root
+from checkpoint import CheckpointStore
+from config import ScraperConfig
+from scraper import AsyncRedditScraper, logger
+
+
+def split_subreddits(subreddit_list: List[str],
+                     workers: int) -> List[List[str]]:
+    """
+    Splits the subreddits round-robin into at most `workers` non-empty shards.
+    """
+    shards = [subreddit_list[i::workers] for i in range(workers)]
+    return [shard for shard in shards if shard]
+
+
+def shard_config(config: ScraperConfig, subreddit_list: List[str], index: int,
+                 workers: int) -> ScraperConfig:
+    """
+    :return: the config of one worker, scraping its shard with a 1/workers
+             share of the rate limit
+    """
+    return dataclasses.replace(
+        config,
+        subreddit_list=subreddit_list,
+        requests_per_second=config.requests_per_second / workers,
+        request_burst=max(1, config.request_burst // workers),
+        max_in_flight=max(1, config.max_in_flight // workers),
+        quota_share=config.quota_share / workers,
+        shard=f'shard{index}of{workers}')
+
+
+def _scrape_shard(config: ScraperConfig) -> dict:
+    """
+    Runs a scraper with its own event loop in a worker process.
+
+    :return: what the worker wrote, its failures and its request metrics
+    """
+    tik = time.perf_counter()
+    scraper = AsyncRedditScraper(config)
+    asyncio.run(scraper.scrape(finish_run=False))
+    scraper.save_to_file()
+    return {
+        'shard': config.shard,
+        'seconds': round(time.perf_counter() - tik, 3),
+        'subreddits': [{
+            'name': data_obj.name,
+            'shard': config.shard,
+            'post_count': data_obj.post_count,
+            'comment_count': data_obj.comment_count,
+            'files': {kind: str(scraper._output_path(data_obj.name, kind))
+                      for kind in ('subreddit', 'posts', 'comments')}
+        } for data_obj in scraper._data],
+        'failures': scraper.failures,
+        'requests': scraper.metrics.to_dict()['request_types']
+    }
+
+
+def scrape_sharded(config: ScraperConfig, workers: int) -> dict:
+    """
+    Scrapes config.subreddit_list with `workers` processes, each running its
+    own event loop on a shard of the subreddits with an equal share of the
+    rate limit. The results are merged into results/manifest_{order}.json.
+
+    Notes:
+        In incremental mode the run is started here and only finished once
+        every worker succeeded, so an interrupted sharded run is resumed like
+        a single process run.
+
+    :param config: the scraper config, rate limits are for all workers together
+    :param workers: number of worker processes
+    :return: the manifest
+    """
+    subreddit_list = config.subreddit_list
+    checkpoint_path = get_project_root().joinpath(config.checkpoint_path)
+    run_id = None
+    if config.incremental:
+        with CheckpointStore(checkpoint_path) as store:
+            run_id, finished = store.start_run(config.order_tag)
+        subreddit_list = [name for name in subreddit_list
+                          if name not in finished]
+
+    shards = split_subreddits(subreddit_list, workers)
+    logger.info(f'scraping {len(subreddit_list)} subreddits with '
+                f'{len(shards)} worker processes')
+    tik = time.perf_counter()
+    results, errors = [], []
+    with ProcessPoolExecutor(max_workers=max(1, len(shards))) as executor:
+        futures = [executor.submit(_scrape_shard,
+                                   shard_config(config, shard, i, len(shards)))
+                   for i, shard in enumerate(shards)]
+        for shard, future in zip(shards, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f'worker scraping {", ".join(shard)} failed: '
+                             f'{e!r}')
+                errors.append({'subreddits': shard, 'error': repr(e)})
+
+    if config.incremental and not errors:
+        with CheckpointStore(checkpoint_path) as store:
+            store.finish_run(run_id)
+
+    subreddits = [subreddit for result in results
+                  for subreddit in result['subreddits']]
+    manifest = {
+        'order': config.order_tag,
+        'workers': len(shards),
+        'seconds': round(time.perf_counter() - tik, 3),
+        'post_count': sum(subreddit['post_count']
+                          for subreddit in subreddits),
+        'comment_count': sum(subreddit['comment_count']
+                             for subreddit in subreddits),
+        'subreddits': sorted(subreddits,
+                             key=lambda subreddit: subreddit['name']),
+        'failures': [failure for result in results
+                     for failure in result['failures']],
+        'worker_errors': errors,
+        'shards': [{key: result[key]
+                    for key in ('shard', 'seconds', 'requests')}
+                   for result in results]
+    }
+    path = get_project_root().joinpath(config.data_dir, 'results',
+                                       f'manifest_{config.order_tag}.json')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(f'{manifest["post_count"]} posts and '
+                f'{manifest["comment_count"]} comments from '
+                f'{len(subreddits)} subreddits, manifest written to {path}')
+    return manifest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='Number of worker processes. "4" by default')
+    parser.add_argument('-f', '--subredditfile', type=str,
+                        default='pages/subreddit_list.txt',
+                        help='File with one subreddit per line, relative to '
+                        'the project root. "pages/subreddit_list.txt" by '
+                        'default')
+    parser.add_argument('-o', '--order', type=str, nargs='+', default=['hot'],
+                        help='The order(s) to scrape the data by. "hot" by '
+                        'default')
+    parser.add_argument('-mp', '--maxpost', type=int, default=1000,
+                        help='The maximum number of posts that can be scraped '
+                        'per subreddit. "1000" by default')
+    parser.add_argument('-mcp', '--maxcommentpost', type=int, default=100,
+                        help='The maximum number comments scraped per post. '
+                        '"100" by default')
+    parser.add_argument('-mc', '--maxcomment', type=int, default=10000,
+                        help='The maximum number comments scraped per '
+                        'subreddit. "10000" by default')
+    parser.add_argument('-em', '--expandmore', type=int, default=0,
+                        help='Expand "more comments" stubs above this comment '
+                        'depth. "0" by default')
+    parser.add_argument('-i', '--incremental', default=False,
+                        action='store_true',
+                        help='Only scrape new posts and comments, see '
+                        'scraper.py. "False" by default.')
+    args = parser.parse_args()
+
+    with open(get_project_root().joinpath(args.subredditfile)) as f:
+        subreddit_list = [line.strip() for line in f if line.strip()]
+    config = ScraperConfig(
+        subreddit_list=subreddit_list,
+        scrape_order=args.order[0] if len(args.order) == 1 else args.order,
+        max_post_count=args.maxpost,
+        max_comment_per_post=args.maxcommentpost,
+        max_comment_count=args.maxcomment,
+        expand_more_depth=args.expandmore,
+        incremental=args.incremental
+    )
+    manifest = scrape_sharded(config, args.workers)
+    sys.exit(1 if manifest['worker_errors'] else 0)
@@ -0,0 +1,149 @@
+# streaming csv output for the scraper
+import csv
+import os
+import shutil
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+
+
+class CsvSink:
+    """
+    Buffered CSV writer with bounded memory.
+
+    Rows are buffered in memory and flushed in chunks to a temporary '.part'
+    file next to the target. commit() moves the temporary file in place
+    atomically, so readers only ever see the previous or the complete file.
+
+    In append mode the header of the existing file must match the columns.
+    A file written before columns were added to the schema is migrated: the
+    new columns are added empty. Any other header raises a ValueError
+    instead of appending misaligned rows.
+
+    Usage:
+        with CsvSink(path, columns) as sink:
+            sink.write(row)
+        # committed on a clean exit, discarded on an exception
+    """
+
+    def __init__(self, path, columns: List[str], append: bool = False,
+                 buffer_rows: int = 1000):
+        """
+        CsvSink constructor
+
+        :param path: the final csv file
+        :param columns: column names of the rows
+        :param append: keep the rows of an existing file and add the new rows
+                       after them
+        :param buffer_rows: number of rows buffered in memory before they are
+                            flushed
+        """
+        self.path = Path(path)
+        self.columns = columns
+        self.buffer_rows = buffer_rows
+        self.rows_written = 0
+        self._buffer = []
+        self._tmp_path = self.path.with_name(self.path.name + '.part')
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._header = True
+        header = self._existing_header() if append else None
+        if header == list(columns):
+            shutil.copyfile(self.path, self._tmp_path)
+            self._header = False
+        elif header is not None:
+            self._migrate(header)
+            self._header = False
+        elif self._tmp_path.exists():
+            # left over from an interrupted run
+            self._tmp_path.unlink()
+
+    def _existing_header(self):
+        """
+        :return: the columns of the existing file, None if there is no file or
+                 it is empty
+        """
+        if not self.path.exists():
+            return None
+        with open(self.path, newline='') as f:
+            return next(csv.reader(f), None)
+
+    def _migrate(self, header: List[str]):
+        """
+        Copies the existing file to the temporary file with the sink's columns,
+        the columns the file does not have are left empty.
+        """
+        unknown = [column for column in header if column not in self.columns]
+        if unknown or len(set(header)) != len(header):
+            raise ValueError(f'cannot append to {self.path}: its columns '
+                             f'{header} do not match {self.columns}. Move '
+                             f'the file away or write to a new one.')
+        positions = [header.index(column) if column in header else None
+                     for column in self.columns]
+        with open(self.path, newline='') as source:
+            with open(self._tmp_path, 'w', newline='') as target:
+                reader = csv.reader(source)
+                # the line terminator of pandas' to_csv, which writes the
+                # other rows
+                writer = csv.writer(target, lineterminator='\n')
+                next(reader)
+                writer.writerow(self.columns)
+                for row in reader:
+                    writer.writerow(['' if i is None else row[i]
+                                     for i in positions])
+
+    def write(self, row: list):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.buffer_rows:
+            self.flush()
+
+    def write_many(self, rows: List[list]):
+        self._buffer.extend(rows)
+        if len(self._buffer) >= self.buffer_rows:
+            self.flush()
+
+    def write_frame(self, df: pd.DataFrame):
+        """
+        Writes a DataFrame with the sink's columns directly, after any
+        buffered rows.
+        """
+        if self._buffer:
+            self.flush()
+        df.to_csv(self._tmp_path, mode='a', header=self._header, index=False,
+                  columns=self.columns)
+        self.rows_written += len(df)
+        self._header = False
+
+    def flush(self):
+        """
+        Writes the buffered rows to the temporary file.
+        """
+        if not self._buffer and not self._header:
+            return
+        pd.DataFrame(self._buffer, columns=self.columns).to_csv(
+            self._tmp_path, mode='a', header=self._header, index=False)
+        self.rows_written += len(self._buffer)
+        self._header = False
+        self._buffer = []
+
+    def commit(self):
+        """
+        Flushes the remaining rows and atomically replaces the target file.
+        """
+        self.flush()
+        os.replace(self._tmp_path, self.path)
+
+    def discard(self):
+        self._buffer = []
+        if self._tmp_path.exists():
+            self._tmp_path.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
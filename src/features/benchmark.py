@@ -0,0 +1,263 @@
+# preprocessing benchmark: step by step pipeline against the fused steps
+import sys
+import argparse
+import os
+import json
+import random
+import re
+import time
+from collections import Counter
+from typing import List, Optional
+
+import contractions
+import pandas as pd
+from nltk.corpus import stopwords
+from nltk.stem import PorterStemmer
+
+from src.features.nltk_data import missing, TOKENIZER
+from src.features.preprocess import PreProcess, SPECIAL_CHARACTERS_PATTERN
+
+# mostly common words, with some contractions, slang, urls, hashtags,
+# newlines and upper case
+_COMMON = ('the be to of and a in that have it for not on with he as you do '
+           'at this but his by from they we say her she or an will my one all '
+           'would there their what so up out if about who get which go me '
+           'when make can like time no just him know take people into year '
+           'your good some could them see other than then now look only come '
+           'its over think also back after use two how our work first well '
+           'way even new want because any these give day most us is are was '
+           'were been has had did said').split()
+_SPECIAL = ["don't", "I'm", "it's", "can't", "you're", "isn't", "u", "ur",
+            "gonna", "idk", "tbh", "I've", "#TIL",
+            "https://www.reddit.com/r/python/comments/abc?x=1&y=2",
+            "http://t.co/xyz", "line\nbreak", "WOW", "Reddit", "100%",
+            "dog's"]
+# sentences with abbreviations, ellipses and quotes, where the sentence
+# splitter decides which periods become tokens of their own
+_PERIOD_HEAVY = ["Mr. X said so. OK etc.", "apples, pears, etc. are fine.",
+                 "see the faq, e.g. the top post... or ask Dr. Smith.",
+                 "it was 3 p.m. in the U.S. so I slept.",
+                 "vs. last year it's better. idk.", "This. So much this.",
+                 "wait... what?!", "(i.e. the old one.)",
+                 'he said "no." and left etc.', "Jr. and Sr. both came etc."]
+
+
+def synthetic_comments(n: int, seed: int = 0) -> pd.DataFrame:
+    """
+    :return: n reddit-like comments of varying length, some missing or
+        deleted and some with period-heavy sentences
+    """
+    rng = random.Random(seed)
+    lengths = [3, 5, 8, 12, 20, 40, 80, 150]
+    comments = [' '.join(rng.choice(_SPECIAL) if rng.random() < 0.05
+                         else rng.choice(_COMMON)
+                         for _ in range(rng.choice(lengths)))
+                for _ in range(n)]
+    for i in range(3, n, 20):
+        if rng.random() < 0.5:
+            comments[i] = rng.choice(_PERIOD_HEAVY) + ' ' + comments[i]
+        else:
+            comments[i] += ' ' + rng.choice(_PERIOD_HEAVY)
+    for i in range(0, n, 40):
+        comments[i] = None
+    for i in range(7, n, 25):
+        comments[i] = '[deleted]'
+    return pd.DataFrame({'comment': comments})
+
+
+# the URL pattern of the original remove_urls
+_ORIGINAL_URL = r'(https|http)?:\/\/(\w|\.|\/|\?|\=|\&|\%)*\b'
+
+
+def _original_sub(pattern, s, flags=0):
+    return re.sub(pattern, '', s, flags=flags) if isinstance(s, str) else s
+
+
+def _original_stems(words: List[str]) -> List[str]:
+    ps = PorterStemmer()
+    return [ps.stem(word) for word in words]
+
+
+def step_by_step_clean(df: pd.DataFrame, column: str) -> pd.DataFrame:
+    """
+    Steps 1-6 of preprocess as the original PreProcess methods ran them,
+    before they were precompiled and fused into clean_text: one apply per
+    step and the patterns looked up on every call.
+    """
+    df[column] = df[column].fillna('')
+    df[column] = df[column].apply(
+        lambda s: _original_sub(_ORIGINAL_URL, s, flags=re.MULTILINE))
+    df[column] = df[column].apply(contractions.fix)
+    df[column] = df[column].apply(lambda s: s.lower())
+    df[column] = df[column].apply(lambda s: _original_sub(r'#', s))
+    df[column] = df[column].apply(lambda s: _original_sub(r'\n', s))
+    return df
+
+
+def step_by_step_preprocess(prep: PreProcess, df: pd.DataFrame,
+                            column: str) -> pd.DataFrame:
+    """
+    preprocess as the original PreProcess methods ran it, before
+    clean_text, clean_tokens and the stem cache. tokenize is unchanged
+    apart from loading the NLTK data.
+    """
+    tokens = column + '_word_token'
+    step_by_step_clean(df, column)
+    prep.tokenize(df, column)
+    df[tokens] = df[tokens].apply(
+        lambda words: [token for token in
+                       (re.sub(r'[^a-zA-Z0-9\s]', '', word) for word in words)
+                       if token != ''])
+    stop_words = set(stopwords.words('english'))
+    df[tokens] = df[tokens].apply(
+        lambda words: [word for word in words if word not in stop_words])
+    df[tokens] = df[tokens].apply(lambda words: list(filter(None, words)))
+    df[tokens] = df[tokens].apply(_original_stems)
+    return df
+
+
+def _timed(fn, *args) -> tuple:
+    tik = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - tik
+
+
+def _agreement(tokens_a: List[List[str]], tokens_b: List[List[str]]) -> float:
+    """
+    :return: share of tokens both tokenizers give, per document and
+        regardless of their order
+    """
+    common = total = 0
+    for a, b in zip(tokens_a, tokens_b):
+        common += 2 * sum((Counter(a) & Counter(b)).values())
+        total += len(a) + len(b)
+    return common / total if total else 1.0
+
+
+def _cleaned(tokens: List[List[str]]) -> List[List[str]]:
+    return [[token for token in (SPECIAL_CHARACTERS_PATTERN.sub('', word)
+                                 for word in words) if token]
+            for words in tokens]
+
+
+def tokenizer_report(texts: List[str], top: int = 10) -> dict:
+    """
+    Parity and throughput of the regex tokenizer against sent_tokenize and
+    word_tokenize.
+
+    :param texts: cleaned texts, as tokenize gets them in preprocess (see
+        clean_text)
+    :param top: number of most frequent differing tokens in the report
+    :return: rows/sec and tokens/sec of both tokenizers, the share of
+        identical documents and the token agreement, before and after
+        removing the special characters like clean_tokens
+    """
+    prep = PreProcess()
+    nltk_df, nltk_seconds = _timed(prep.tokenize,
+                                   pd.DataFrame({'text': texts}), 'text')
+    regex_df, regex_seconds = _timed(prep.regex_tokenize,
+                                     pd.DataFrame({'text': texts}), 'text')
+    nltk_tokens = nltk_df['text_word_token'].tolist()
+    regex_tokens = regex_df['text_word_token'].tolist()
+
+    differences = Counter()
+    for a, b in zip(nltk_tokens, regex_tokens):
+        if a != b:
+            a, b = Counter(a), Counter(b)
+            differences.update({f'nltk {token!r}': count
+                                for token, count in (a - b).items()})
+            differences.update({f'regex {token!r}': count
+                                for token, count in (b - a).items()})
+    token_count = sum(map(len, nltk_tokens))
+    regex_token_count = sum(map(len, regex_tokens))
+    identical = sum(a == b for a, b in zip(nltk_tokens, regex_tokens))
+    return {
+        'rows': len(texts),
+        'nltk': {'seconds': round(nltk_seconds, 3),
+                 'rows_per_sec': round(len(texts) / nltk_seconds),
+                 'tokens_per_sec': round(token_count / nltk_seconds)},
+        'regex': {'seconds': round(regex_seconds, 3),
+                  'rows_per_sec': round(len(texts) / regex_seconds),
+                  'tokens_per_sec': round(regex_token_count / regex_seconds)},
+        'speedup': round(nltk_seconds / regex_seconds, 2),
+        'identical_documents': round(identical / max(1, len(texts)), 4),
+        'token_agreement': round(_agreement(nltk_tokens, regex_tokens), 4),
+        'cleaned_token_agreement': round(
+            _agreement(_cleaned(nltk_tokens), _cleaned(regex_tokens)), 4),
+        'top_differences': differences.most_common(top)
+    }
+
+
+def run_benchmark(df: pd.DataFrame, column: str = 'comment',
+                  workers: Optional[int] = None) -> dict:
+    """
+    Times the step by step and the fused cleaning (and full preprocess if
+    the NLTK data is available) on copies of df and checks that both give
+    the same output. The full preprocess is also timed with
+    parallel_preprocess on `workers` processes, and the regex tokenizer is
+    compared with the NLTK tokenizers, see tokenizer_report.
+
+    :return: seconds and speedup per stage
+    """
+    prep = PreProcess()
+    report = {'rows': len(df)}
+
+    before, before_seconds = _timed(step_by_step_clean, df.copy(), column)
+    after, after_seconds = _timed(prep.clean_text, df.copy(), column)
+    report['clean_text'] = {
+        'step_by_step_seconds': round(before_seconds, 3),
+        'fused_seconds': round(after_seconds, 3),
+        'speedup': round(before_seconds / after_seconds, 2),
+        'same_output': bool(before[column].equals(after[column]))}
+
+    if not missing([TOKENIZER]):
+        report['tokenize'] = tokenizer_report(after[column].tolist())
+    else:
+        report['tokenize'] = 'skipped, NLTK data not available'
+
+    if not missing([TOKENIZER, 'stopwords']):
+        before, before_seconds = _timed(step_by_step_preprocess, prep,
+                                        df.copy(), column)
+        after, after_seconds = _timed(prep.preprocess, df.copy(), column)
+        report['preprocess'] = {
+            'step_by_step_seconds': round(before_seconds, 3),
+            'fused_seconds': round(after_seconds, 3),
+            'speedup': round(before_seconds / after_seconds, 2),
+            'same_output': bool(before.equals(after))}
+        parallel, parallel_seconds = _timed(prep.parallel_preprocess,
+                                            df.copy(), column, False, None,
+                                            workers)
+        report['parallel_preprocess'] = {
+            'workers': workers or os.cpu_count(),
+            'fused_seconds': round(after_seconds, 3),
+            'parallel_seconds': round(parallel_seconds, 3),
+            'speedup': round(after_seconds / parallel_seconds, 2),
+            'same_output': bool(after.equals(parallel))}
+    else:
+        report['preprocess'] = 'skipped, NLTK data not available'
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--file', type=str, default=None,
+                        help='Comments csv written by the scraper, e.g. '
+                        'data/raw/Music_hot_comments.csv. Synthetic comments '
+                        'by default')
+    parser.add_argument('-c', '--column', type=str, default='comment',
+                        help='Column to preprocess. "comment" by default')
+    parser.add_argument('-n', '--rows', type=int, default=20000,
+                        help='Number of comments. "20000" by default')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Number of parallel preprocessing processes. '
+                        'Number of CPUs by default')
+    args = parser.parse_args()
+
+    if args.file:
+        data = pd.read_csv(args.file, lineterminator='\n',
+                           nrows=args.rows)[[args.column]]
+    else:
+        data = synthetic_comments(args.rows)
+    json.dump(run_benchmark(data, args.column, args.workers), sys.stdout,
+              indent=2)
+    print()
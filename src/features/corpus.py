@@ -0,0 +1,146 @@
+# compact token representation of preprocessed documents
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+
+class TokenCorpus:
+    """
+    Tokenized documents as integer ids into an interned vocabulary.
+
+    Notes:
+        A column of token lists keeps one Python list per document and one
+        string object per token. A TokenCorpus keeps every distinct token
+        once, in vocab, and the documents as one flat int32 array of token
+        ids with int64 offsets: the tokens of document i are
+        ids[offsets[i]:offsets[i + 1]]. ids and offsets are the indices and
+        indptr of the CSR document-term matrix, so the matrix is built without
+        another pass over the tokens.
+
+    Usage:
+        corpus = TokenCorpus.from_tokens(df['comment_word_token'])
+        corpus.most_common(20)
+        dtm = corpus.document_term_matrix()
+    """
+
+    def __init__(self, vocab: List[str], ids: np.ndarray, offsets: np.ndarray,
+                 index: Optional[Dict[str, int]] = None):
+        """
+        TokenCorpus constructor
+
+        :param vocab: the distinct tokens, the id of a token is its position
+        :param ids: token ids of all documents, one after the other
+        :param offsets: start of every document in ids, followed by len(ids)
+        :param index: mapping of token to id, built from vocab if not given
+        """
+        self.vocab = vocab
+        if index is None:
+            index = {token: i for i, token in enumerate(vocab)}
+        self.index: Dict[str, int] = index
+        self.ids = ids
+        self.offsets = offsets
+
+    @classmethod
+    def from_tokens(cls, documents: Iterable[List[str]],
+                    vocab: Optional[List[str]] = None) -> 'TokenCorpus':
+        """
+        :param documents: token lists, e.g. a column_word_token column
+        :param vocab: vocabulary to extend, e.g. of the corpus of another
+            chunk, so ids are shared
+        """
+        vocab = list(vocab) if vocab is not None else []
+        index = {token: i for i, token in enumerate(vocab)}
+        ids = []
+        offsets = [0]
+        for tokens in documents:
+            for token in tokens:
+                token_id = index.get(token)
+                if token_id is None:
+                    token_id = index[token] = len(vocab)
+                    vocab.append(sys.intern(token))
+                ids.append(token_id)
+            offsets.append(len(ids))
+        return cls(vocab, np.array(ids, dtype=np.int32),
+                   np.array(offsets, dtype=np.int64), index)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def document_ids(self, i: int) -> np.ndarray:
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, i: int) -> List[str]:
+        return [self.vocab[token_id] for token_id in self.document_ids(i)]
+
+    def to_tokens(self) -> List[List[str]]:
+        """
+        :return: the token lists the corpus was built from
+        """
+        return [self[i] for i in range(len(self))]
+
+    def to_strings(self) -> List[str]:
+        """
+        :return: the tokens of every document joined by spaces, e.g. the
+            documents of BERTopic
+        """
+        return [' '.join(tokens) for tokens in self.to_tokens()]
+
+    def lengths(self) -> np.ndarray:
+        """
+        :return: number of tokens of every document
+        """
+        return np.diff(self.offsets)
+
+    def term_frequencies(self) -> np.ndarray:
+        """
+        :return: number of occurrences of every token id
+        """
+        return np.bincount(self.ids, minlength=len(self.vocab))
+
+    def most_common(self, n: int) -> List[Tuple[str, int]]:
+        """
+        :return: the n most frequent tokens and their counts, ties in order of
+            first occurrence
+        """
+        frequencies = self.term_frequencies()
+        top = np.argsort(-frequencies, kind='stable')[:n]
+        return [(self.vocab[token_id], int(frequencies[token_id]))
+                for token_id in top]
+
+    def document_term_matrix(self) -> sp.csr_matrix:
+        """
+        :return: documents x vocab matrix of token counts
+        """
+        counts = np.ones(len(self.ids), dtype=np.int32)
+        matrix = sp.csr_matrix((counts, self.ids, self.offsets),
+                               shape=(len(self), len(self.vocab)), copy=True)
+        # repeated tokens of a document are separate entries until they are
+        # summed, which sorts the indices in place, hence the copy of ids
+        matrix.sum_duplicates()
+        return matrix
+
+    def save(self, path):
+        """
+        Saves the corpus as a compressed .npz file. The vocab is stored like
+        the documents, as the UTF-8 bytes of all tokens with the offsets of
+        every token, rather than as a fixed-width array padded to the longest
+        token.
+        """
+        encoded = [token.encode('utf-8') for token in self.vocab]
+        vocab_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(token) for token in encoded], out=vocab_offsets[1:])
+        vocab_bytes = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        np.savez_compressed(path, vocab_bytes=vocab_bytes,
+                            vocab_offsets=vocab_offsets, ids=self.ids,
+                            offsets=self.offsets)
+
+    @classmethod
+    def load(cls, path) -> 'TokenCorpus':
+        with np.load(path) as data:
+            raw = data['vocab_bytes'].tobytes()
+            bounds = data['vocab_offsets'].tolist()
+            vocab = [sys.intern(raw[start:end].decode('utf-8'))
+                     for start, end in zip(bounds[:-1], bounds[1:])]
+            return cls(vocab, data['ids'], data['offsets'])
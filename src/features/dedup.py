@@ -0,0 +1,184 @@
+# collapsing of repeated texts, so expensive stages run once per distinct text
+import re
+import zlib
+from collections import defaultdict
+from typing import Callable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+# MinHash permutations are (a * h + b) mod this Mersenne prime, small enough
+# for the products to fit in 64 bits
+_PRIME = (1 << 31) - 1
+
+
+def normalize(text):
+    """
+    Key of a text for the uncased models: lower case with runs of whitespace
+    collapsed
+    """
+    if not isinstance(text, str):
+        return text
+    return WHITESPACE_PATTERN.sub(' ', text).strip().lower()
+
+
+def _shingles(text: str, size: int) -> np.ndarray:
+    words = text.split()
+    return np.array([zlib.crc32(' '.join(words[i:i + size]).encode())
+                     % _PRIME for i in range(len(words) - size + 1)],
+                    dtype=np.uint64)
+
+
+class DuplicateIndex:
+    """
+    Maps the rows of a text column to their distinct texts.
+
+    Notes:
+        Rows are grouped by their exact text, or by normalize(text) for
+        stages that ignore case and whitespace. With near_duplicates,
+        distinct texts of at least min_words words whose word shingles have
+        an estimated Jaccard similarity of `threshold` or more (MinHash with
+        locality sensitive hashing) are grouped too, e.g. copy-pasta with a
+        word changed. A group is represented by the text of its first row, so
+        the results of near-duplicates are those of the representative.
+
+    Usage:
+        index = DuplicateIndex(df['comment'])
+        df['score'] = index.expand(score(index.texts))
+    """
+
+    def __init__(self, texts, normalized: bool = False,
+                 near_duplicates: bool = False, threshold: float = 0.8,
+                 num_perm: int = 64, bands: int = 16, shingle_size: int = 3,
+                 min_words: int = 8, seed: int = 0):
+        """
+        DuplicateIndex constructor
+
+        :param texts: the texts, in row order. Missing values form one group
+        :param normalized: group texts that are equal after normalize()
+        :param near_duplicates: also group near-duplicate texts with MinHash
+        :param threshold: minimum estimated Jaccard similarity of
+            near-duplicates
+        :param num_perm: number of MinHash permutations
+        :param bands: number of LSH bands, num_perm must be a multiple of it
+        :param shingle_size: number of words per shingle
+        :param min_words: texts with fewer words are only grouped with exact
+            duplicates
+        :param seed: seed of the MinHash permutations
+        """
+        texts = pd.Series(texts, dtype=object).reset_index(drop=True)
+        keys = texts.map(normalize) if normalized else texts
+        codes, _ = pd.factorize(keys, use_na_sentinel=False)
+        # first row of every distinct key
+        num_keys = codes.max() + 1 if len(codes) else 0
+        first_rows = np.full(num_keys, len(codes), dtype=np.int64)
+        np.minimum.at(first_rows, codes, np.arange(len(codes)))
+        self.exact_groups = len(first_rows)
+
+        if near_duplicates:
+            representative = self._near_duplicates(
+                keys.iloc[first_rows].tolist(), threshold, num_perm, bands,
+                shingle_size, min_words, seed)
+            groups = np.unique(representative)
+            codes = np.searchsorted(groups, representative[codes])
+            first_rows = first_rows[groups]
+
+        self.codes = codes
+        self.rows = first_rows
+        self.texts: List = texts.iloc[first_rows].tolist()
+
+    @staticmethod
+    def _near_duplicates(keys: list, threshold: float, num_perm: int,
+                         bands: int, shingle_size: int, min_words: int,
+                         seed: int) -> np.ndarray:
+        """
+        :return: for every key, the position of the first key of its
+            near-duplicate group
+        """
+        rng = np.random.default_rng(seed)
+        a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)
+        b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)
+        rows_per_band = num_perm // bands
+
+        parent = np.arange(len(keys))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        signatures = {}
+        buckets = defaultdict(list)
+        for i, key in enumerate(keys):
+            if not isinstance(key, str) or len(key.split()) < min_words:
+                continue
+            shingles = _shingles(key, shingle_size)
+            hashes = (a[:, None] * shingles[None, :] + b[:, None]) % _PRIME
+            signature = hashes.min(axis=1)
+            signatures[i] = signature
+            for band in range(bands):
+                start = band * rows_per_band
+                band_signature = signature[start:start + rows_per_band]
+                buckets[band, band_signature.tobytes()].append(i)
+
+        for bucket in buckets.values():
+            for j in bucket[1:]:
+                root_i, root_j = find(bucket[0]), find(j)
+                if root_i == root_j:
+                    continue
+                similarity = np.mean(signatures[bucket[0]] == signatures[j])
+                if similarity >= threshold:
+                    # the earlier text stays the representative
+                    parent[max(root_i, root_j)] = min(root_i, root_j)
+        return np.array([find(i) for i in range(len(keys))], dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def expand(self, values) -> np.ndarray:
+        """
+        :param values: one value per distinct text, in the order of self.texts
+        :return: the value of every row
+        """
+        if not isinstance(values, (np.ndarray, pd.Series)):
+            # through a Series, so lists of tokens stay one object per text
+            values = pd.Series(list(values))
+        return np.asarray(values)[self.codes]
+
+    @property
+    def dedup_ratio(self) -> float:
+        """
+        Share of the rows that are not processed: 1 - distinct texts / rows
+        """
+        return 1 - len(self.texts) / len(self) if len(self) else 0.0
+
+    def report(self) -> dict:
+        return {'rows': len(self),
+                'distinct_texts': len(self.texts),
+                'exact_duplicates': len(self) - self.exact_groups,
+                'near_duplicates': self.exact_groups - len(self.texts),
+                'dedup_ratio': round(self.dedup_ratio, 4)}
+
+    def __str__(self) -> str:
+        return (f'{len(self)} rows, {len(self.texts)} distinct texts '
+                f'({round(100 * self.dedup_ratio, 1)}% of the rows are '
+                f'duplicates)')
+
+
+def map_unique(fn: Callable[[list], list], texts,
+               index: Optional[DuplicateIndex] = None,
+               **index_kwargs) -> np.ndarray:
+    """
+    Runs fn once on the distinct texts and fans the results out to all rows.
+
+    :param fn: function of a list of texts, returning one result per text
+    :param texts: the texts, in row order
+    :param index: DuplicateIndex of the texts, built with index_kwargs if not
+        given
+    :return: the result of every row
+    """
+    if index is None:
+        index = DuplicateIndex(texts, **index_kwargs)
+    return index.expand(fn(index.texts))
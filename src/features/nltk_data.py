@@ -0,0 +1,112 @@
+# local NLTK data: resolved on first use, provisioned once, no network access
+# at import
+import sys
+import argparse
+import functools
+import os
+from typing import Dict, Iterable, List
+
+import nltk
+
+from src.utils import get_project_root
+
+# folder the NLTK data is provisioned to, searched before the default NLTK
+# locations
+NLTK_DATA_DIR = get_project_root().joinpath('data', 'external', 'nltk_data')
+
+# NLTK 3.9 replaced the pickled punkt tokenizer and perceptron tagger with
+# these resources
+_NLTK_VERSION = tuple(int(part) for part in nltk.__version__.split('.')[:2])
+_NEW_RESOURCES = _NLTK_VERSION >= (3, 9)
+_TAGGER_NAME = ('averaged_perceptron_tagger_eng' if _NEW_RESOURCES
+                else 'averaged_perceptron_tagger')
+
+# resources used by the pipeline and their paths in the NLTK data folder
+RESOURCES: Dict[str, str] = {
+    'punkt_tab' if _NEW_RESOURCES else 'punkt':
+        'tokenizers/punkt_tab' if _NEW_RESOURCES else 'tokenizers/punkt',
+    'stopwords': 'corpora/stopwords',
+    _TAGGER_NAME: 'taggers/' + _TAGGER_NAME,
+    'wordnet': 'corpora/wordnet',
+    'omw-1.4': 'corpora/omw-1.4'
+}
+TOKENIZER = next(name for name in RESOURCES if name.startswith('punkt'))
+TAGGER = next(name for name in RESOURCES
+              if name.startswith('averaged_perceptron_tagger'))
+
+
+def use_local_data():
+    """
+    Puts NLTK_DATA_DIR first on the NLTK search path. Does not touch the file
+    system or the network.
+    """
+    if str(NLTK_DATA_DIR) not in nltk.data.path:
+        nltk.data.path.insert(0, str(NLTK_DATA_DIR))
+
+
+def is_present(name: str) -> bool:
+    """
+    Presence check of a resource in the NLTK search path, by the file system
+    only: neither the resource nor its zip file is opened.
+    """
+    path = RESOURCES[name]
+    return any(os.path.exists(os.path.join(folder, path))
+               or os.path.exists(os.path.join(folder, path + '.zip'))
+               for folder in nltk.data.path)
+
+
+def missing(names: Iterable[str] = RESOURCES) -> List[str]:
+    """
+    :return: the resources that are not in the NLTK search path
+    """
+    return [name for name in names if not is_present(name)]
+
+
+@functools.lru_cache(maxsize=None)
+def require(*names: str):
+    """
+    Checks that the resources are provisioned, once per process and set of
+    resources. Called before the first use of a resource, so a missing one
+    fails fast with a clear message instead of an NLTK LookupError deep in
+    the pipeline.
+
+    :raises LookupError: if a resource is missing
+    """
+    absent = missing(names)
+    if absent:
+        raise LookupError(f'NLTK data {", ".join(absent)} not found in '
+                          f'{NLTK_DATA_DIR} or the NLTK data path. '
+                          f'Provision it once with: '
+                          f'python src/features/nltk_data.py')
+
+
+def provision(names: Iterable[str] = RESOURCES,
+              data_dir=NLTK_DATA_DIR) -> List[str]:
+    """
+    Downloads the missing resources to data_dir. This is the only function
+    that uses the network.
+
+    :return: the resources that could not be downloaded
+    """
+    failed = []
+    for name in missing(names):
+        if not nltk.download(name, download_dir=str(data_dir), quiet=True,
+                             raise_on_error=False):
+            failed.append(name)
+    return failed
+
+
+use_local_data()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--check', default=False, action='store_true',
+                        help='Only check that the NLTK data is present, '
+                        'without downloading. "False" by default')
+    args = parser.parse_args()
+
+    absent = missing() if args.check else provision()
+    for name in RESOURCES:
+        print(f'{name}: {"missing" if name in absent else "present"}')
+    sys.exit(1 if absent else 0)
@@ -1,18 +1,277 @@
 import pandas as pd
-import numpy as np
 import nltk
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.corpus import stopwords, wordnet
+from nltk.tokenize import sent_tokenize, word_tokenize, NLTKWordTokenizer
+from nltk.corpus import stopwords
 from nltk.stem import WordNetLemmatizer, PorterStemmer
+import argparse
+import os
 import re
+import functools
+import contextlib
+from collections import deque
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+from pandas.errors import ParserError
 import contractions
 
+from src.data.sink import CsvSink
+from src.features.corpus import TokenCorpus
+from src.features.dedup import DuplicateIndex
+from src.features.profiler import StepProfiler
+from src.features.nltk_data import require, TOKENIZER, TAGGER
+from src.features.threads import ThreadIndex
+
+# patterns of the cleaning steps, compiled once
+URL_PATTERN = re.compile(r'(https|http)?:\/\/(\w|\.|\/|\?|\=|\&|\%)*\b',
+                         flags=re.MULTILINE)
+SPECIAL_CHARACTERS_PATTERN = re.compile(r'[^a-zA-Z0-9\s]')
+SPECIAL_CHARACTERS_AND_DIGITS_PATTERN = re.compile(r'[^a-zA-Z\s]')
+# characters clean_text removes after lower casing: hashtags and newlines
+_REMOVED_CHARACTERS = str.maketrans('', '', '#\n')
+
+# number of distinct lemmas and stems kept in the caches shared by all rows
+# and calls
+LEMMA_CACHE_SIZE = 2 ** 17
+STEM_CACHE_SIZE = 2 ** 17
+# Mapping the first letter of NLTK POS tags to WordNet POS tags, the values of
+# wordnet.ADJ, NOUN, VERB and ADV (reading them would load the wordnet corpus)
+WORDNET_POS = {"J": 'a', "N": 'n', "V": 'v', "R": 'r'}
+
+# PreProcess methods run by preprocess, see run_steps
+PREPROCESS_STEPS = ('clean_text', 'tokenize', 'clean_tokens', 'stem')
+PREPROCESS_LEMM_STEPS = ('clean_text', 'tokenize', 'clean_tokens', 'lemm')
+# regex_tokenize: characters word_tokenize always splits off as tokens, and the
+# runs of other characters between them and whitespace
+_SPLIT_CHARACTERS = r";@#$%&?!*()\[\]{}<>\u2012-\u2015«»“”‘’„"
+TOKEN_PATTERN = re.compile(
+    rf"`+|''|[{_SPLIT_CHARACTERS}]|[^\s{_SPLIT_CHARACTERS}`\"]+")
+# double quotes word_tokenize turns into `` (opening) and '' (closing)
+OPENING_QUOTE_PATTERN = re.compile(r'(?:^|(?<=[ (\[{<]))"')
+# texts and tokens word_tokenize splits further: periods, commas, colons,
+# apostrophes, double dashes and words like "gonna"
+REFINE_PATTERN = re.compile(
+    r"[.,:']|--|\b(?:cannot|gimme|gonna|gotta|lemme|wanna)\b",
+    flags=re.IGNORECASE)
+# abbreviations the punkt sentence tokenizer does not end a sentence after
+ABBREVIATIONS = frozenset(['mr', 'mrs', 'ms', 'dr', 'st', 'jr', 'sr', 'vs',
+                           'etc', 'e.g', 'i.e', 'u.s', 'a.m', 'p.m', 'inc',
+                           'co', 'corp', 'ltd'])
+# tokens word_tokenize lets follow the final period of a sentence
+CLOSING_TOKENS = frozenset([')', ']', '}', '>', "''"])
+TOKEN_CACHE_SIZE = 2 ** 16
+_word_tokenizer = NLTKWordTokenizer()
+
+# rows per chunk of parallel_preprocess
+CHUNK_SIZE = 1000
+# rows read from a file at a time by iter_preprocess_csv
+FILE_CHUNK_SIZE = 10000
+
+_lemmatizer = WordNetLemmatizer()
+_stemmer = PorterStemmer()
+
+
+@functools.lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def cached_lemma(word, pos):
+    """
+    WordNet lemma of a word, cached
+
+    :param word: the word
+    :param pos: its WordNet POS, see WORDNET_POS
+    """
+    return _lemmatizer.lemmatize(word, pos)
+
+
+@functools.lru_cache(maxsize=STEM_CACHE_SIZE)
+def cached_stem(word):
+    """
+    Porter stem of a word, cached
+
+    :param word: the word
+    """
+    return _stemmer.stem(word)
+
+
+@functools.lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def refine_token(token):
+    """
+    Splits a token of TOKEN_PATTERN like word_tokenize on a sentence of its
+    own: a trailing period (unless the token is an abbreviation), commas and
+    colons, clitics like 's, double dashes, ellipses and words like "gonna".
+    Cached, the same tokens come up again and again.
+
+    :param token: the token
+    :return: the tokens it is split into
+    """
+    if token[-1:] == '.' and token[:-1].lower() in ABBREVIATIONS:
+        return token,
+    return tuple(_word_tokenizer.tokenize(token))
+
+
+def regex_word_tokenize(text):
+    """
+    Tokens of a text, near-identical to the tokens of sent_tokenize followed
+    by word_tokenize: one pass of TOKEN_PATTERN, and the rare tokens with
+    periods, commas, colons or apostrophes split further by refine_token.
+    Sentences only change the tokens through their final period, which is
+    split from every token but abbreviations, and from abbreviations too at
+    the end of the text.
+
+    :param text: the text
+    :return: list of tokens
+    """
+    if '"' in text:
+        text = OPENING_QUOTE_PATTERN.sub(' `` ', text).replace('"', " '' ")
+    tokens = TOKEN_PATTERN.findall(text)
+    if REFINE_PATTERN.search(text) is None:
+        return tokens
+    refined = []
+    for token in tokens:
+        if REFINE_PATTERN.search(token) is None:
+            refined.append(token)
+        else:
+            refined.extend(refine_token(token))
+    # the end of the text ends a sentence, word_tokenize splits its final
+    # period off an abbreviation as well
+    last = len(refined) - 1
+    while last >= 0 and refined[last] in CLOSING_TOKENS:
+        last -= 1
+    token = refined[last] if last >= 0 else ''
+    if token[-1:] == '.' and token[:-1].lower() in ABBREVIATIONS:
+        refined[last:last + 1] = token[:-1], '.'
+    return refined
+
+
+def clean_one_text(text):
+    """
+    Steps 2-6 of preprocess on one text, see PreProcess.clean_text
+
+    :param text: the text, not missing
+    """
+    # every URL_PATTERN match contains '://'
+    if '://' in text:
+        text = URL_PATTERN.sub('', text)
+    return contractions.fix(text).lower().translate(_REMOVED_CHARACTERS)
+
+
+@functools.lru_cache(maxsize=None)
+def english_stopwords():
+    """
+    NLTK english stopwords, read from the corpus once per process
+    """
+    require('stopwords')
+    return frozenset(stopwords.words('english'))
+
+
+def preprocess_steps(lemm=False, tokenizer='nltk'):
+    """
+    :param lemm: lemmatize instead of stemming
+    :param tokenizer: 'nltk' or 'regex', see PreProcess.tokenize
+    :return: the steps of PreProcess.preprocess, see run_steps
+    """
+    steps = PREPROCESS_LEMM_STEPS if lemm else PREPROCESS_STEPS
+    if tokenizer == 'regex':
+        return tuple('regex_tokenize' if step == 'tokenize' else step
+                     for step in steps)
+    if tokenizer != 'nltk':
+        raise ValueError(f"unknown tokenizer backend {tokenizer!r}, "
+                         "use 'nltk' or 'regex'")
+    return steps
+
+
+def run_steps(df, column, steps, profiler=None):
+    """
+    Runs PreProcess methods on a column in the given order
+
+    :param df: Dataframe to manipulate
+    :param column: The column to preprocess
+    :param steps: names of PreProcess methods taking (df, column)
+    :param profiler: StepProfiler recording every step. None by default
+    """
+    prep = PreProcess()
+    if profiler is None:
+        for step in steps:
+            getattr(prep, step)(df, column)
+        return df
+    for step in steps:
+        with profiler.step(step, len(df)):
+            getattr(prep, step)(df, column)
+    return df
+
+
+def _profiled(profiler, name, rows):
+    """
+    profiler.step(name, rows), or a context measuring nothing without a
+    profiler
+    """
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.step(name, rows)
 
-nltk.download('punkt')
-nltk.download('stopwords')
-nltk.download('averaged_perceptron_tagger')
-nltk.download('wordnet')
-nltk.download('omw-1.4')
+
+def _copy_cell(value):
+    """
+    Copy of a list cell, lists of lists (like the tags of lemm) included,
+    so rows fanned out from the same distinct text do not share it
+    """
+    if not isinstance(value, list):
+        return value
+    if value and isinstance(value[0], list):
+        return [_copy_cell(item) for item in value]
+    return value.copy()
+
+
+def run_deduplicated(df, column, process, near_duplicates=False,
+                     profiler=None):
+    """
+    Runs process on a Dataframe of the distinct values of the column instead
+    of df, and fans the columns it derives out to all the rows with the same
+    value. The column itself keeps the original text of every row, near
+    duplicates would otherwise get the text of the first of them. Every row
+    gets its own copy of list cells like the tokens, so editing them in
+    place does not change its duplicates. The rows and distinct values are
+    reported in df.attrs['dedup'].
+
+    :param df: Dataframe to manipulate
+    :param column: The column to preprocess
+    :param process: function of a Dataframe, e.g.
+        lambda d: run_steps(d, column, steps)
+    :param near_duplicates: also collapse near-duplicate texts, see
+        DuplicateIndex. Their output is the output of the first of them
+    :param profiler: StepProfiler recording the 'dedup' and 'fan_out' steps
+    """
+    with _profiled(profiler, 'dedup', len(df)):
+        index = DuplicateIndex(df[column], near_duplicates=near_duplicates)
+        distinct = pd.DataFrame({column: index.texts})
+    process(distinct)
+    with _profiled(profiler, 'fan_out', len(df)):
+        for name in distinct.columns.drop(column):
+            values = index.expand(distinct[name])
+            if values.dtype == object:
+                for i, value in enumerate(values):
+                    if isinstance(value, list):
+                        values[i] = _copy_cell(value)
+            df[name] = values
+    df.attrs['dedup'] = index.report()
+    return df
+
+
+def _init_worker(steps):
+    """
+    Process pool initializer. Runs the steps on a one row Dataframe, so the
+    NLTK resources they use (tokenizer, stopwords, tagger, wordnet) are
+    loaded once per worker instead of once per chunk.
+    """
+    run_steps(pd.DataFrame({'text': ["warming up the workers isn't slow"]}),
+              'text', steps)
+
+
+def _run_chunk(chunk, column, steps):
+    return run_steps(chunk, column, steps)
+
+
+def _run_profiled_chunk(chunk, column, steps, track_memory):
+    profiler = StepProfiler(track_memory)
+    return run_steps(chunk, column, steps, profiler), profiler.records
 
 
 class PreProcess:
@@ -32,10 +291,14 @@ class PreProcess:
 
     Functions:
         fill_na: performs on the column itself
+        clean_text: fill_na, remove_urls, expand_contractions, to_lower,
+            remove_hashtags and remove_escape_chars in one pass
         tokenize: generates a column_word_token column
+        regex_tokenize: tokenize with a compiled regex instead of NLTK
         clean_special_characters: performs on both column or column_word_token
             Performs on column_word_token by default
         filter_stopwords: performs on column_word_token
+        clean_tokens: clean_special_characters and filter_stopwords in one pass
         remove_urls: performs on the column itself
         expand_contractions: performs on the column itself
         remove_hashtags: performs on the column itself
@@ -44,7 +307,11 @@ class PreProcess:
         lemm: performs on column_word_token
         token_to_str: converts the column_word_token back into a string in a
             new column
+        token_corpus: converts the column_word_token into a TokenCorpus of
+            integer token ids
         preprocess: an all in one function
+        parallel_preprocess: preprocess, or any steps, on chunks of the
+            Dataframe in a process pool
     """
 
     def __init__(self):
@@ -62,7 +329,7 @@ class PreProcess:
         df[column] = df[column].fillna('')
         return df
 
-    def tokenize(self, df, column):
+    def tokenize(self, df, column, backend='nltk'):
         """
         Tokenize the content
         Column: Raw strings
@@ -70,7 +337,14 @@ class PreProcess:
 
         :param df: Dataframe to manipulate
         :param column: The column to preprocess
+        :param backend: 'nltk' for sent_tokenize and word_tokenize, 'regex'
+            for regex_tokenize
         """
+        if backend == 'regex':
+            return self.regex_tokenize(df, column)
+        if backend != 'nltk':
+            raise ValueError(f"unknown tokenizer backend {backend!r}, "
+                             "use 'nltk' or 'regex'")
 
         def word_tokenize_helper(sentences):
             if len(sentences) == 0:
@@ -81,10 +355,28 @@ class PreProcess:
                     tokenized_list.extend(word_tokenize(s))
                 return tokenized_list
 
+        require(TOKENIZER)
         df[column + '_word_token'] = df[column].apply(sent_tokenize).apply(
             lambda s: word_tokenize_helper(s))
         return df
 
+    def regex_tokenize(self, df, column):
+        """
+        Tokenize the content with a compiled regex instead of the NLTK
+        tokenizers, several times faster and without NLTK data. The tokens
+        are near-identical to tokenize, see regex_word_tokenize and
+        src/features/benchmark.py for the parity report, which is only
+        measured on synthetic comments so far
+        Column: Raw strings
+        Performs the task in the column: "column + '_word_token'"
+
+        :param df: Dataframe to manipulate
+        :param column: The column to preprocess
+        """
+        df[column + '_word_token'] = [regex_word_tokenize(text)
+                                      for text in df[column]]
+        return df
+
     def clean_special_characters(self, df, column, tokenized_column=True,
                                  remove_digits=False):
         """
@@ -109,18 +401,18 @@ class PreProcess:
             """
             clean_sentences = []
             if not remove_digits:
-                pattern = r'[^a-zA-Z0-9\s]'
+                pattern = SPECIAL_CHARACTERS_PATTERN
             else:
-                pattern = r'[^a-zA-Z\s]'
+                pattern = SPECIAL_CHARACTERS_AND_DIGITS_PATTERN
 
             if tokenized_column:
                 for token in sentences:
-                    clean_text = re.sub(pattern, '', token)
+                    clean_text = pattern.sub('', token)
                     if clean_text != '':
                         clean_sentences.append(clean_text)
                 return clean_sentences
             else:
-                clean_text = re.sub(pattern, '', sentences[0])
+                clean_text = pattern.sub('', sentences[0])
                 return clean_text
 
         if tokenized_column:
@@ -143,7 +435,7 @@ class PreProcess:
         :param df: Dataframe to manipulate
         :param column: The column to preprocess
         """
-        stop_words = set(stopwords.words('english'))
+        stop_words = english_stopwords()
 
         def filter_stopwords(words):
             """
@@ -159,6 +451,30 @@ class PreProcess:
             lambda s: list(filter(None, s)))
         return df
 
+    def clean_tokens(self, df, column, remove_digits=False):
+        """
+        Same output as clean_special_characters followed by filter_stopwords,
+        in a single pass over the tokens of each row
+        NOTE: MUST BE CALLED AFTER tokenize
+        Column: List of word tokens
+        Performs the task in the column: "column + '_word_token'"
+
+        :param df: Dataframe to manipulate
+        :param column: The column to preprocess
+        :param remove_digits: Option to remove digits as special characters
+        """
+        stop_words = english_stopwords()
+        if remove_digits:
+            sub = SPECIAL_CHARACTERS_AND_DIGITS_PATTERN.sub
+        else:
+            sub = SPECIAL_CHARACTERS_PATTERN.sub
+
+        df[column + '_word_token'] = [
+            [token for token in (sub('', word) for word in words)
+             if token and token not in stop_words]
+            for words in df[column + '_word_token']]
+        return df
+
     def remove_urls(self, df, column):
         """
         Function used to remove urls from strings
@@ -174,9 +490,7 @@ class PreProcess:
             Helper function used to replace URLs with empty string
             """
             if isinstance(s, str):
-                return re.sub(
-                    r'(https|http)?:\/\/(\w|\.|\/|\?|\=|\&|\%)*\b', '', s,
-                    flags=re.MULTILINE)
+                return URL_PATTERN.sub('', s)
             else:
                 return s
 
@@ -233,7 +547,7 @@ class PreProcess:
             Helper function used to replace hashtags with empty string
             """
             if isinstance(s, str):
-                return re.sub(r'#', '', s)
+                return s.replace('#', '')
             else:
                 return s
 
@@ -256,7 +570,7 @@ class PreProcess:
             string
             """
             if isinstance(s, str):
-                return re.sub(r'\n', '', s)
+                return s.replace('\n', '')
             else:
                 return s
 
@@ -274,19 +588,8 @@ class PreProcess:
         :param column: The column to preprocess
         """
 
-        def get_stems(words):
-            """
-            Reduce the words to their base word (stem) by cutting off the ends
-            """
-            ps = PorterStemmer()
-            stems = []
-            for word in words:
-                stems.append(ps.stem(word))
-            # print(stems)
-            return stems
-
-        df[column + '_word_token'] = df[column + '_word_token'].apply(
-            get_stems)
+        df[column + '_word_token'] = [[cached_stem(word) for word in words]
+                                      for words in df[column + '_word_token']]
         return df
 
     def to_lower(self, df, column):
@@ -297,10 +600,36 @@ class PreProcess:
         :param column: The column to preprocess
         """
         df[column] = df[column].apply(lambda s: s.lower())
+        return df
+
+    def clean_text(self, df, column):
+        """
+        Same output as fill_na, remove_urls, expand_contractions, to_lower,
+        remove_hashtags and remove_escape_chars called in this order, in one
+        pass over the distinct texts of the column: the URL pattern only runs
+        on texts containing '://', contractions.fix once per distinct text,
+        and hashtags and newlines are removed with a single str.translate.
+        Column: Raw strings
+        Performs the task in-place (in the same column)
+
+        :param df: Dataframe to manipulate
+        :param column: The column to preprocess
+        """
+        text = df[column].fillna('').astype(object)
+        if text.empty:
+            df[column] = text
+            return df
+        distinct = text.unique()
+        cleaned = dict(zip(distinct, map(clean_one_text, distinct)))
+        df[column] = text.map(cleaned)
+        return df
 
     def lemm(self, df, column):
         """
         Lemm the tokenized words. This will also POS TAG the tokenized words.
+        Each row is tagged once as a whole, so the tags take the context of
+        the words into account. The tags are stored in the column
+        "column + '_tag'" as a list of [(word, tag)] per row.
         NOTE: MUST BE CALLED AFTER tokenize
         Column: List of word tokens
         Performs the task in the column: "column + '_word_token'"
@@ -308,40 +637,15 @@ class PreProcess:
         :param df: Dataframe to manipulate
         :param column: The column to preprocess
         """
-
-        def get_pos_tags(words):
-            """
-            Helper function
-            Get the part of speech (POS) tags for the words
-            """
-            tags = []
-            for word in words:
-                tags.append(nltk.pos_tag([word]))
-            return tags
-
-        def get_lemma(word_tags):
-            """
-            Helper function
-            Reduce the words to their base word (lemma) by using a lexicon
-            """
-            wordnet_lemmatizer = WordNetLemmatizer()
-            lemma = []
-            for element in word_tags:
-                word = element[0][0]
-                pos = element[0][1]
-                tag = nltk.pos_tag([word])[0][1][0].upper()
-                tag_dict = {"J": wordnet.ADJ,
-                            # Mapping NLTK POS tags to WordNet POS tags
-                            "N": wordnet.NOUN,
-                            "V": wordnet.VERB,
-                            "R": wordnet.ADV}
-
-                wordnet_pos = tag_dict.get(tag, wordnet.NOUN)
-                lemma.append(wordnet_lemmatizer.lemmatize(word, wordnet_pos))
-            return lemma
-
-        df[column + '_tag'] = df[column + '_word_token'].apply(get_pos_tags)
-        df[column + '_word_token'] = df[column + '_tag'].apply(get_lemma)
+        require(TAGGER, 'wordnet')
+        tagged = nltk.pos_tag_sents(df[column + '_word_token'].tolist())
+
+        df[column + '_tag'] = [[[word_tag] for word_tag in word_tags]
+                               for word_tags in tagged]
+        df[column + '_word_token'] = [
+            [cached_lemma(word, WORDNET_POS.get(tag[:1].upper(), 'n'))
+             for word, tag in word_tags]
+            for word_tags in tagged]
         return df
 
     def token_to_str(self, df, column):
@@ -356,36 +660,48 @@ class PreProcess:
             lambda s: ' '.join(s))
         return df
 
+    def token_corpus(self, df, column, drop=False, vocab=None):
+        """
+        Converts the tokenized words into a TokenCorpus: an interned
+        vocabulary and the token ids of all rows in one int32 array, which
+        takes a fraction of the memory of the lists of strings and gives word
+        frequencies and a document-term matrix without joining the tokens.
+        NOTE: MUST BE CALLED AFTER tokenize
+        Column: List of word tokens
+
+        :param df: Dataframe to manipulate
+        :param column: The column to preprocess
+        :param drop: drop the column "column + '_word_token'" once converted
+        :param vocab: vocabulary of another TokenCorpus to share token ids with
+        """
+        corpus = TokenCorpus.from_tokens(df[column + '_word_token'], vocab)
+        if drop:
+            df.drop(columns=column + '_word_token', inplace=True)
+        return corpus
+
     @staticmethod
     def get_parent_comment(df):
         """
         Generates parent_comment column. Finds the parent of a column.
         Must have 'comment' and 'parent_id' in dataframe.
-        
+        Comments replying to the post get '', comments whose parent is not
+        in the dataframe get NaN. The parents are looked up in a ThreadIndex,
+        in linear time.
+
         :param df: Dataframe to manipulate
         """
-        parent_comments = []
-        for i in range(len(df)):
-            if pd.isna(df.iloc[i]['parent_id']):
-                parent_comments.append(np.nan)
-                continue
-            parent_tier, parent_id = df.iloc[i]['parent_id'].split('_')
-
-            # If parent is post, then no parent comment
-            if parent_tier == 't3':
-                parent_comments.append('')
-                continue
-
-            parent_comments.append(df[df['comment_id'] == parent_id].iloc[0]['comment'])
-        df['parent_comment'] = parent_comments
+        index = ThreadIndex.from_frame(df)
+        df['parent_comment'] = index.parent_comment(df['comment'])
         return df
 
-    def preprocess(self, df, column, lemm=False):
+    def preprocess(self, df, column, lemm=False, tokenizer='nltk', dedup=False,
+                   near_duplicates=False, profiler=None):
         """
         All in one function that calls the other preprocessing functions to
         quickly generate preprocessed text.
 
-        Preprocesses the column by:
+        Preprocesses the column by (1-6 fused in clean_text, 8-9 in
+        clean_tokens):
         1. fill_na for empty strings
         2. remove URLs
         3. expand contractions
@@ -402,18 +718,203 @@ class PreProcess:
         :param df: Dataframe to manipulate
         :param column: The column to preprocess
         :param lemm: boolean to compute lemmatization. False by default.
+        :param tokenizer: tokenizer backend of step 7, 'nltk' or 'regex'.
+            'nltk' by default, see tokenize
+        :param dedup: preprocess every distinct text once and copy the output
+            to its duplicates, see run_deduplicated. The column then keeps
+            its original texts. False by default
+        :param near_duplicates: with dedup, also collapse near-duplicate texts
+        :param profiler: StepProfiler recording the time, rows/sec and memory
+            of every step, see profiler.summary(). None by default
         """
-        self.fill_na(df, column)
-        self.remove_urls(df, column)
-        self.expand_contractions(df, column)
-        self.to_lower(df, column)
-        self.remove_hashtags(df, column)
-        self.remove_escape_chars(df, column)
-        self.tokenize(df, column)
-        self.clean_special_characters(df, column)
-        self.filter_stopwords(df, column)
-        if lemm:
-            self.lemm(df, column)
-        else:
-            self.stem(df, column)
+        steps = preprocess_steps(lemm, tokenizer)
+        if dedup:
+            return run_deduplicated(
+                df, column,
+                lambda distinct: run_steps(distinct, column, steps, profiler),
+                near_duplicates, profiler)
+        return run_steps(df, column, steps, profiler)
+
+    def parallel_preprocess(self, df, column, lemm=False, steps=None,
+                            workers=None, chunk_size=CHUNK_SIZE,
+                            tokenizer='nltk', dedup=False,
+                            near_duplicates=False, profiler=None):
+        """
+        Same output as preprocess (or run_steps with the given steps), with
+        the Dataframe split into chunks of rows that are processed in a pool
+        of worker processes. The NLTK resources are loaded once per worker
+        and the chunks are put back together in the original row order.
+        Runs in the calling process if there is only one chunk or one worker.
+        Performs the tasks in the same columns as the steps
+
+        :param df: Dataframe to manipulate
+        :param column: The column to preprocess
+        :param lemm: boolean to compute lemmatization. False by default.
+        :param steps: names of PreProcess methods to run instead of the
+            preprocess steps, e.g. ('clean_text', 'tokenize')
+        :param workers: number of worker processes. Number of CPUs by default
+        :param chunk_size: number of rows per chunk
+        :param tokenizer: tokenizer backend of the preprocess steps, 'nltk' or
+            'regex'. 'nltk' by default, see tokenize
+        :param dedup: preprocess every distinct text once and copy the output
+            to its duplicates, see run_deduplicated. The column then keeps
+            its original texts. False by default
+        :param near_duplicates: with dedup, also collapse near-duplicate texts
+        :param profiler: StepProfiler recording the steps of every chunk, see
+            StepProfiler. None by default
+        """
+        if steps is None:
+            steps = preprocess_steps(lemm, tokenizer)
+        steps = tuple(steps)
+        if dedup:
+            def process(distinct):
+                return self.parallel_preprocess(
+                    distinct, column, steps=steps, workers=workers,
+                    chunk_size=chunk_size, profiler=profiler)
+            return run_deduplicated(df, column, process, near_duplicates,
+                                    profiler)
+        workers = workers or os.cpu_count() or 1
+        chunks = [df.iloc[i:i + chunk_size]
+                  for i in range(0, len(df), chunk_size)]
+        if workers == 1 or len(chunks) <= 1:
+            return run_steps(df, column, steps, profiler)
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)),
+                                 initializer=_init_worker,
+                                 initargs=(steps,)) as executor:
+            # map yields the results in the order of the chunks
+            if profiler is None:
+                result = pd.concat(executor.map(_run_chunk, chunks,
+                                                repeat(column), repeat(steps)))
+            else:
+                results = list(executor.map(_run_profiled_chunk, chunks,
+                                            repeat(column), repeat(steps),
+                                            repeat(profiler.track_memory)))
+                for _, records in results:
+                    profiler.merge(records)
+                result = pd.concat(chunk for chunk, _ in results)
+        for name in result.columns:
+            df[name] = result[name].to_numpy()
         return df
+
+
+def _read_csv_chunks(path, chunk_size, **read_csv_kwargs):
+    """
+    Reads a csv file in chunks of rows. Like BertModels, files pandas cannot
+    parse are read again with '\n' as the only line terminator, as long as
+    no chunk was returned yet.
+    """
+    returned = False
+    try:
+        for chunk in pd.read_csv(path, chunksize=chunk_size,
+                                 **read_csv_kwargs):
+            returned = True
+            yield chunk
+    except ParserError:
+        if returned or 'lineterminator' in read_csv_kwargs:
+            raise
+        yield from pd.read_csv(path, chunksize=chunk_size,
+                               lineterminator='\n', **read_csv_kwargs)
+
+
+def iter_preprocess_csv(path, column, steps=PREPROCESS_STEPS,
+                        chunk_size=FILE_CHUNK_SIZE, workers=1,
+                        **read_csv_kwargs):
+    """
+    Preprocesses a posts or comments csv file chunk by chunk, so memory is
+    bounded by the chunk size instead of the file size. With several workers
+    the chunks are processed in a process pool, with at most 2 chunks per
+    worker read ahead. Chunks are yielded in file order.
+
+    Usage:
+        for chunk in iter_preprocess_csv('data/raw/Music_hot_comments.csv',
+                                         'comment'):
+            ...
+
+    :param path: the csv file
+    :param column: The column to preprocess
+    :param steps: names of PreProcess methods to run, see run_steps
+    :param chunk_size: number of rows per chunk
+    :param workers: number of worker processes
+    :param read_csv_kwargs: passed to pd.read_csv, e.g. usecols
+    :return: generator of preprocessed chunks, with the row numbers of the
+        file as index
+    """
+    steps = tuple(steps)
+    chunks = _read_csv_chunks(path, chunk_size, **read_csv_kwargs)
+    if workers == 1:
+        for chunk in chunks:
+            yield run_steps(chunk, column, steps)
+        return
+
+    window = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(steps,)) as executor:
+        for chunk in chunks:
+            window.append(executor.submit(_run_chunk, chunk, column, steps))
+            while len(window) > 2 * workers:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+
+def preprocess_csv(path, output_path, column, steps=PREPROCESS_STEPS,
+                   chunk_size=FILE_CHUNK_SIZE, workers=1, append=False,
+                   **read_csv_kwargs):
+    """
+    Writes the chunks of iter_preprocess_csv to a csv file. The output file
+    is only replaced once every chunk is written, see CsvSink.
+
+    :param output_path: the preprocessed csv file
+    :param append: add the rows to an existing output file instead of
+        replacing it
+    :return: number of rows written
+    """
+    sink = None
+    try:
+        for chunk in iter_preprocess_csv(path, column, steps, chunk_size,
+                                         workers, **read_csv_kwargs):
+            if sink is None:
+                sink = CsvSink(output_path, list(chunk.columns),
+                               append=append)
+            sink.write_frame(chunk)
+    except BaseException:
+        if sink is not None:
+            sink.discard()
+        raise
+    if sink is None:
+        return 0
+    sink.commit()
+    return sink.rows_written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file', type=str,
+                        help='Posts or comments csv, e.g. '
+                        'data/raw/Music_hot_comments.csv')
+    parser.add_argument('output', type=str,
+                        help='Preprocessed csv to write')
+    parser.add_argument('-c', '--column', type=str, default='comment',
+                        help='Column to preprocess. "comment" by default')
+    parser.add_argument('-l', '--lemm', default=False, action='store_true',
+                        help='Lemmatize instead of stemming. '
+                        '"False" by default')
+    parser.add_argument('-t', '--tokenizer', type=str, default='nltk',
+                        choices=['nltk', 'regex'],
+                        help='Tokenizer backend, see PreProcess.tokenize. '
+                        '"nltk" by default')
+    parser.add_argument('-n', '--chunksize', type=int, default=FILE_CHUNK_SIZE,
+                        help='Rows read and preprocessed at a time. '
+                        f'"{FILE_CHUNK_SIZE}" by default')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of worker processes. "1" by default')
+    parser.add_argument('--append', default=False, action='store_true',
+                        help='Add the rows to an existing output file '
+                        'instead of replacing it. "False" by default')
+    args = parser.parse_args()
+
+    rows = preprocess_csv(args.file, args.output, args.column,
+                          preprocess_steps(args.lemm, args.tokenizer),
+                          args.chunksize, args.workers, args.append)
+    print(f'{rows} rows preprocessed to {args.output}')
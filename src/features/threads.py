@@ -0,0 +1,162 @@
+# comment thread structure of a comments DataFrame
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+# parent_row of comments replying to the post, and of comments whose parent
+# is unknown
+POST_PARENT = -1
+UNKNOWN_PARENT = -2
+
+
+class ThreadIndex:
+    """
+    Parent/child structure of the comments of a DataFrame, built in one pass.
+
+    Notes:
+        Rows are identified by their position in the DataFrame. parent_row
+        holds the row of the parent comment, POST_PARENT for comments
+        replying to the post and UNKNOWN_PARENT when parent_id is missing or
+        the parent comment is not in the DataFrame (e.g. it was not scraped).
+        The children of row i are
+        children[child_offsets[i]:child_offsets[i + 1]], in row order.
+        root_row and depth are relative to the highest ancestor in the
+        DataFrame: the top-level comment of the thread, or the comment whose
+        parent is unknown.
+
+        parent_comment, nth_ancestor and subtree_sizes are array lookups, so
+        the cost is linear in the number of comments instead of one DataFrame
+        scan per reply.
+
+    Usage:
+        threads = ThreadIndex.from_frame(comments_df)
+        comments_df['parent_comment'] = threads.parent_comment(
+            comments_df['comment'])
+    """
+
+    def __init__(self, comment_ids, parent_ids):
+        """
+        ThreadIndex constructor
+
+        :param comment_ids: id of every comment, without the 't1_' prefix
+        :param parent_ids: fullname of the parent of every comment, e.g.
+            't1_abc' or 't3_xyz'
+        """
+        comment_ids = pd.Series(comment_ids,
+                                dtype=object).reset_index(drop=True)
+        parent_ids = pd.Series(parent_ids, dtype=object).reset_index(drop=True)
+        n = len(comment_ids)
+
+        # the first row of a duplicated comment id is its parent, like a
+        # DataFrame lookup would return
+        self.row_of = {}
+        for row, comment_id in enumerate(comment_ids):
+            self.row_of.setdefault(comment_id, row)
+
+        is_str = parent_ids.map(
+            lambda parent_id: isinstance(parent_id, str)).to_numpy(dtype=bool)
+        parents = parent_ids.where(is_str, '').astype(str)
+        kinds = parents.str[:2].to_numpy()
+        parent_rows = parents.str[3:].map(self.row_of).to_numpy(
+            dtype=float, na_value=np.nan)
+
+        self.parent_row = np.full(n, UNKNOWN_PARENT, dtype=np.int64)
+        self.parent_row[is_str & (kinds == 't3')] = POST_PARENT
+        is_reply = is_str & (kinds == 't1') & ~np.isnan(parent_rows)
+        self.parent_row[is_reply] = parent_rows[is_reply].astype(np.int64)
+
+        # children in CSR form, a stable sort keeps the children of a comment
+        # in row order
+        has_parent = self.parent_row >= 0
+        order = np.argsort(self.parent_row[has_parent], kind='stable')
+        self.children = np.flatnonzero(has_parent)[order]
+        self.child_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.parent_row[has_parent], minlength=n),
+                  out=self.child_offsets[1:])
+
+        # breadth-first from the highest ancestors, one level at a time.
+        # Comments in a parent cycle (corrupted data) are never reached and
+        # keep depth -1
+        self.depth = np.full(n, -1, dtype=np.int64)
+        self.root_row = np.full(n, -1, dtype=np.int64)
+        self._levels: List[np.ndarray] = []
+        level = np.flatnonzero(~has_parent)
+        self.root_row[level] = level
+        while len(level):
+            self.depth[level] = len(self._levels)
+            self._levels.append(level)
+            level_children = self._children_of(level)
+            self.root_row[level_children] = self.root_row[
+                self.parent_row[level_children]]
+            level = level_children
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'ThreadIndex':
+        """
+        :param df: comments with 'comment_id' and 'parent_id' columns
+        """
+        return cls(df['comment_id'], df['parent_id'])
+
+    def __len__(self) -> int:
+        return len(self.parent_row)
+
+    def _children_of(self, rows: np.ndarray) -> np.ndarray:
+        starts = self.child_offsets[rows]
+        counts = self.child_offsets[rows + 1] - starts
+        # positions starts[k], starts[k] + 1, ... starts[k] + counts[k] - 1
+        # for every row k
+        positions = np.arange(counts.sum()) + np.repeat(
+            starts - np.cumsum(counts) + counts, counts)
+        return self.children[positions]
+
+    def children_of(self, row: int) -> np.ndarray:
+        start, end = self.child_offsets[row], self.child_offsets[row + 1]
+        return self.children[start:end]
+
+    def parent_comment(self, comments) -> np.ndarray:
+        """
+        :param comments: text of every comment, in row order
+        :return: text of the parent comment of every comment, '' for comments
+            replying to the post and NaN if the parent is unknown
+        """
+        comments = np.asarray(comments, dtype=object)
+        parents = np.full(len(self), np.nan, dtype=object)
+        parents[self.parent_row == POST_PARENT] = ''
+        has_parent = self.parent_row >= 0
+        parents[has_parent] = comments[self.parent_row[has_parent]]
+        return parents
+
+    def nth_ancestor(self, n: int) -> np.ndarray:
+        """
+        :return: row of the n-th ancestor comment of every comment (1 is the
+            parent), or a negative parent_row value if the chain ends before
+        """
+        rows = np.arange(len(self))
+        for _ in range(n):
+            has_parent = rows >= 0
+            rows[has_parent] = self.parent_row[rows[has_parent]]
+        return rows
+
+    def ancestors(self, row: int) -> List[int]:
+        """
+        :return: rows of the ancestor comments of a comment, parent first
+        """
+        chain = []
+        row = self.parent_row[row]
+        while row >= 0 and len(chain) < len(self):
+            chain.append(int(row))
+            row = self.parent_row[row]
+        return chain
+
+    def subtree_sizes(self) -> np.ndarray:
+        """
+        :return: number of comments in the subtree of every comment, itself
+            included
+        """
+        sizes = np.ones(len(self), dtype=np.int64)
+        # deepest level first, so every subtree is complete before it is added
+        # to its parent
+        for level in reversed(self._levels[1:]):
+            np.add.at(sizes, self.parent_row[level], sizes[level])
+        return sizes
@@ -3,7 +3,8 @@ import pandas as pd
 from pandas.errors import ParserError
 import matplotlib.pyplot as plt
 from src.utils import get_project_root
-from src.features.preprocess import PreProcess #DEPENDENCY
+from src.features.preprocess import PreProcess, run_steps #DEPENDENCY
+from src.features.dedup import DuplicateIndex
 
 from bertopic import BERTopic
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
@@ -12,10 +13,8 @@ import requests
 from bs4 import BeautifulSoup
 import contractions
 
-import nltk
 from nltk.tokenize import sent_tokenize, word_tokenize
 from nltk.corpus import stopwords, wordnet
-from nltk.probability import FreqDist
 from nltk.stem import WordNetLemmatizer, PorterStemmer
 import re
 import contractions
@@ -23,11 +22,18 @@ from pprint import pprint
 
 import os
 
-nltk.download('punkt')
-nltk.download('stopwords')
-nltk.download('averaged_perceptron_tagger')
-nltk.download('wordnet')
-nltk.download('omw-1.4')
+# PreProcess steps of topic_preprocess. Escape characters and special
+# characters are kept
+TOPIC_PREPROCESS_STEPS = ('fill_na', 'remove_urls', 'expand_contractions',
+                          'to_lower', 'tokenize', 'filter_stopwords', 'lemm')
+# PreProcess steps of sentiment_preprocess, the model sees the text with its
+# case and punctuation
+SENTIMENT_PREPROCESS_STEPS = ('fill_na', 'remove_urls', 'expand_contractions',
+                              'remove_escape_chars')
+# texts per forward pass of the sentiment model, and its maximum input length
+# in tokens
+SENTIMENT_BATCH_SIZE = 32
+SENTIMENT_MAX_TOKENS = 512
 
 
 class BertModels:
@@ -64,6 +70,7 @@ class BertModels:
         self.model = None
         self.topics = None
         self.docs = None
+        self.corpus = None
         self.topic_probs = None
 
     def eda(self, tdf, pre='body'):
@@ -90,16 +97,12 @@ class BertModels:
         print("Number of Entries: ",df.shape[0])
         print("Columns: ",df.columns)
 
-        all_words = [word for tokens in df[pre + '_word_token'] for word in tokens]
-        post_lengths = [len(tokens) for tokens in df[pre + '_word_token']]
-        vocab = sorted(list(set(all_words)))
+        corpus = prep.token_corpus(df, pre)
 
-        print('{} words total (after preprocessing), with a vocabulary size of {}'.format(len(all_words), len(vocab)))
-        print('Max entry length is {}'.format(max(post_lengths)))
+        print('{} words total (after preprocessing), with a vocabulary size of {}'.format(len(corpus.ids), len(corpus.vocab)))
+        print('Max entry length is {}'.format(corpus.lengths().max()))
 
-        flat_words = [item for sublist in df[pre + '_word_token'] for item in sublist]
-        word_freq = FreqDist(flat_words)
-        fdf = pd.DataFrame(word_freq.most_common(20), columns=['word', 'frequency'])
+        fdf = pd.DataFrame(corpus.most_common(20), columns=['word', 'frequency'])
         fdf.plot(kind='bar', x='word', rot=70)
         plt.show()
 
@@ -110,12 +113,21 @@ class BertModels:
         plt.ylabel("Count of Entries")
         plt.show()
 
-    def topic_preprocess(self, df, col):
+    def topic_preprocess(self, df, col, workers=1, chunk_size=1000,
+                         near_duplicates=False, profiler=None):
         """
         Preprocess DataFrame and make ready for BERTopic modeling. 
 
         :param df: DataFrame with subreddit data to be processed
         :param col: column name to be processed
+        :param workers: number of preprocessing processes, None for the
+            number of CPUs. 1 (in the calling process) by default, a pool
+            only pays off on large Dataframes
+        :param chunk_size: number of rows preprocessed at a time by a process
+        :param near_duplicates: also preprocess near-duplicate texts once,
+            see DuplicateIndex
+        :param profiler: StepProfiler recording every step, its summary is
+            printed at the end
         """
         prep = PreProcess()
 
@@ -126,51 +138,40 @@ class BertModels:
         df = df.reset_index()
         print('Num rows removed: ', temp - df.shape[0])
 
-        print('Fill NaNs')
-        prep.fill_na(df, col)
-
-        print('Remove URLs')
-        prep.remove_urls(df, col)
-
-        print('Expand Contractions')
-        prep.expand_contractions(df, col)
-
-#         print('Remove Escape Characters')
-#         prep.remove_escape_chars(df, col)
-
-        print('Make Lowercase')
-        prep.to_lower(df, col)
-
-        print('Tokenize')
-        prep.tokenize(df, col)
-
-#         print('Clean Special Characters')
-#         prep.clean_special_characters(df, col)
-
-        print('Filter Stopwords')
-        prep.filter_stopwords(df, col)
-
-        print('Lemmatization')
-        prep.lemm(df, col)
+        print('Fill NaNs, Remove URLs, Expand Contractions, Make Lowercase, '
+              'Tokenize, Filter Stopwords, Lemmatization')
+        prep.parallel_preprocess(df, col, steps=TOPIC_PREPROCESS_STEPS,
+                                 workers=workers, chunk_size=chunk_size,
+                                 dedup=True, near_duplicates=near_duplicates,
+                                 profiler=profiler)
+        print('Dedup: ', df.attrs['dedup'])
+        if profiler is not None:
+            print(profiler.summary())
         
         return df
 
-    def topic_modeling(self, df, col='body_word_token', calculate_probabilities=True, verbose=True, visualize=True):
+    def topic_modeling(self, df, col='body_word_token', calculate_probabilities=True, verbose=True, visualize=True,
+                       corpus=None):
         """
         Topic Modeling performed using BERTopic.
 
         :param df: Processed DataFrame ready for topic modeling
         :param col: Column to be processed
         :param calculate_probabilities:  
+        :param corpus: TokenCorpus of the documents (see PreProcess.token_corpus), used instead of df[col]
         """
 
-        try:
-            df['body_string'] = df[col].apply(lambda x: ' '.join(map(str, x)))
-            body_df = df.reset_index()
-        except:
-            raise Exception('Need to preprocess')
-
-        docs = list(body_df.body_string)
+        if corpus is not None:
+            docs = corpus.to_strings()
+        else:
+            try:
+                docs = [' '.join(map(str, tokens)) for tokens in df[col]]
+            except Exception:
+                raise Exception('Need to preprocess')
+        self.corpus = corpus
+
+        if df is not None:
+            df['body_string'] = docs
         self.docs = docs
         print('Number of entries being modeled:', len(docs))
 
@@ -257,39 +258,94 @@ class BertModels:
         except Exception:
             print("Model was not found!")
 
-    def sentiment_preprocess(self, df, col):
+    def sentiment_preprocess(self, df, col, profiler=None):
+        """
+        Preprocess DataFrame for sentiment analysis.
+
+        :param df: DataFrame with subreddit data to be processed
+        :param col: column name to be processed
+        :param profiler: StepProfiler recording every step, its summary is
+            printed at the end
+        """
 
         df[col] = df[col].astype(str)
         df = df[df[col] != 'nan']
         df = df.reset_index()
 
-        prep = PreProcess()
-
-        print('Fill NaNs')
-        prep.fill_na(df, col)
-
-        print('Remove URLs')
-        prep.remove_urls(df, col)
-
-        print('Expand Contractions')
-        prep.expand_contractions(df, col)
-
-        print('Remove escape characters.')
-        prep.remove_escape_chars(df, col)
+        print('Fill NaNs, Remove URLs, Expand Contractions, '
+              'Remove escape characters')
+        run_steps(df, col, SENTIMENT_PREPROCESS_STEPS, profiler)
+        if profiler is not None:
+            print(profiler.summary())
 
         return df
 
-    def sentiment_analysis(self, df, col):
-
-        def sentiment_score(post):
-            '''
-            For sentiment scoring of posts.
-            '''
-            tokens = self.tokenizer.encode(post, return_tensors='pt')
-            result = self.sentiment_model(tokens)
-            return int(torch.argmax(result.logits))+1
-
-        df['sentiment'] = df[col].apply(lambda x: sentiment_score(x[:512]))
+    def sentiment_scores(self, texts, batch_size=SENTIMENT_BATCH_SIZE,
+                         max_length=SENTIMENT_MAX_TOKENS):
+        """
+        Scores the sentiment of texts from 1 (negative) to 5 (positive) in
+        batches.
+
+        The texts are sorted by token length so every batch holds texts of
+        similar length and is only padded to its longest text. Texts longer
+        than max_length tokens are truncated instead of failing in the model.
+
+        :param texts: list of texts
+        :param batch_size: number of texts per forward pass
+        :param max_length: maximum number of tokens of a text, special tokens
+            included
+        :return: array with the score of every text, in the order of texts
+        """
+        # the tokenizer rejects an empty batch
+        if len(texts) == 0:
+            return np.empty(0, dtype=np.int64)
+        encodings = self.tokenizer(list(texts), truncation=True,
+                                   max_length=max_length)
+        lengths = np.array([len(ids) for ids in encodings['input_ids']])
+        order = np.argsort(lengths, kind='stable')
+        scores = np.empty(len(lengths), dtype=np.int64)
+
+        with torch.inference_mode():
+            for start in range(0, len(order), batch_size):
+                rows = order[start:start + batch_size]
+                batch = self.tokenizer.pad(
+                    {key: [values[row] for row in rows]
+                     for key, values in encodings.items()},
+                    return_tensors='pt')
+                logits = self.sentiment_model(**batch).logits
+                scores[rows] = logits.argmax(dim=-1).numpy() + 1
+        return scores
+
+    def sentiment_analysis(self, df, col, dedup=True, near_duplicates=False,
+                           batch_size=SENTIMENT_BATCH_SIZE, max_chars=512):
+        """
+        Scores the sentiment of every row from 1 (negative) to 5 (positive).
+
+        :param df: DataFrame preprocessed with sentiment_preprocess
+        :param col: column name to be scored
+        :param dedup: score every distinct text once, ignoring case and
+            whitespace like the uncased model. True by default
+        :param near_duplicates: with dedup, also score near-duplicate texts
+            once, see DuplicateIndex
+        :param batch_size: number of texts per forward pass, see
+            sentiment_scores
+        :param max_chars: texts are cut to this many characters before
+            tokenization. None keeps the whole text up to the token limit of
+            the model
+        """
+        if max_chars is None:
+            texts = df[col]
+        else:
+            texts = df[col].apply(lambda x: x[:max_chars])
+        if not dedup:
+            df['sentiment'] = self.sentiment_scores(texts, batch_size)
+            return df
+
+        index = DuplicateIndex(texts, normalized=True,
+                               near_duplicates=near_duplicates)
+        print('Dedup: ', index)
+        scores = self.sentiment_scores(index.texts, batch_size)
+        df['sentiment'] = index.expand(scores)
         return df
 
     def sentiment_viz(self, df):
@@ -3,21 +3,50 @@ import numpy as np
 from src.utils import get_project_root
 from src.features.preprocess import PreProcess
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+from src.features.dedup import DuplicateIndex
 
 
 class Relevance:
 
-    def __init__(self, compared_with: str = 'title'):
+    def __init__(self, compared_with: str = 'title', dedup: bool = True, near_duplicates: bool = False):
         """
         Relevance object constructor
         :param compared_with: the item to compare comments with. Can take values: 'title', 'body', 'title-body',
             'parent', 'title-parent', 'body-parent', 'title-body-parent'
+        :param dedup: embed every distinct text once, ignoring case and whitespace like the uncased model.
+            True by default
+        :param near_duplicates: with dedup, also embed near-duplicate texts once, see DuplicateIndex
         """
         self.compared_with = compared_with
         self.model = SentenceTransformer('bert-base-nli-mean-tokens')
+        self.dedup = dedup
+        self.near_duplicates = near_duplicates
         self.df = None
 
+    def get_similarities(self, pairs):
+        """
+        Cosine similarity of the embeddings of every (comment, topic) pair. All the texts are
+        embedded in one call, every distinct text once if dedup is set.
+        :param pairs: (comment, topic) pairs, or None for a similarity of 0
+        :return: one similarity per pair
+        """
+        similarities = np.zeros(len(pairs))
+        scored = [i for i, pair in enumerate(pairs) if pair is not None]
+        if not scored:
+            return similarities
+        texts = [pairs[i][0] for i in scored] + [pairs[i][1] for i in scored]
+        if self.dedup:
+            index = DuplicateIndex(texts, normalized=True, near_duplicates=self.near_duplicates)
+            print('Dedup: ', index)
+            embeddings = index.expand(self.model.encode(index.texts))
+        else:
+            embeddings = self.model.encode(texts)
+
+        embeddings = normalize(embeddings)
+        similarities[scored] = np.sum(embeddings[:len(scored)] * embeddings[len(scored):], axis=1)
+        return similarities
+
     def generate_relevance(self, df):
         """
         Generates a relevance score for each comment compared to either title, body, or both.
@@ -42,11 +71,11 @@ class Relevance:
         pp.fill_na(title_body_comment, 'body')
         # pp.fill_na(title_body_comment, 'comment')
 
-        similarities = np.array([])
+        pairs = []
         for post_id in title_body_comment['post_id'].unique():
             temp = title_body_comment[title_body_comment['post_id'] == post_id]
             if pd.isnull(temp.iloc[0]['comment']):
-                similarities = np.append(similarities, 0)
+                pairs.append(None)
                 continue
             title = temp.iloc[0]['title']
             body = temp.iloc[0]['body']            
@@ -59,13 +88,8 @@ class Relevance:
 
             topic = compared_dict[self.compared_with]
 
-            comments = temp['comment'].to_list()
-            comments.append(topic)
-
-            sentence_embeddings = self.model.encode(comments)
-            similarity = cosine_similarity([sentence_embeddings[-1]], sentence_embeddings[:-1])
-            similarities = np.append(similarities, similarity.flatten())
-        df['relevance'] = similarities
+            pairs.extend((comment, topic) for comment in temp['comment'])
+        df['relevance'] = self.get_similarities(pairs)
         self.df = df
         return df
     
@@ -88,12 +112,12 @@ class Relevance:
         pp.fill_na(title_body_comment, 'body')
         pp.fill_na(title_body_comment, 'parent_comment')
         
-        similarities = np.array([])
+        pairs = []
         for post_id in title_body_comment['post_id'].unique():
             temp = title_body_comment[title_body_comment['post_id'] == post_id]
             
             if pd.isnull(temp.iloc[0]['comment']):
-                similarities = np.append(similarities, 0)
+                pairs.append(None)
                 continue
             
             title = temp.iloc[0]['title']
@@ -112,12 +136,8 @@ class Relevance:
                 topic = compared_dict[self.compared_with]
 
                 comment = temp.iloc[i]['comment']
-                comments = [comment, topic]
-
-                sentence_embeddings = self.model.encode(comments)
-                similarity = cosine_similarity([sentence_embeddings[-1]], sentence_embeddings[:-1])
-                similarities = np.append(similarities, similarity.flatten())
-        df['relevance'] = similarities
+                pairs.append((comment, topic))
+        df['relevance'] = self.get_similarities(pairs)
         self.df = df
         return df
 